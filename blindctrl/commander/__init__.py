@@ -0,0 +1 @@
+"""This module derives the desired blind states from the window power values."""
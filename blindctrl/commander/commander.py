@@ -3,13 +3,17 @@
 
 # standard modules
 import sys
-import os
 import logging
-import configparser
 import traceback
 
 # self-defined modules
 from blindctrl.shared.stdscript import StandardScript
+from blindctrl.shared.statestore import create_state_store
+from blindctrl.shared.history import create_history
+from blindctrl.shared.deadband import create_change_filter
+from blindctrl.shared.clients import get_opc_client
+from blindctrl.shared.ctrlword import create_control_codec
+from blindctrl.shared.mqttsink import get_mqtt_sink
 
 
 usage = """\
@@ -20,22 +24,41 @@ Derive desired blind state based on the window power values.
 
 
 class Commander(StandardScript):
-    def __init__(self):
+    def __init__(self, config=None):
         # call parent constructor
-        super().__init__()
+        super().__init__(config)
         
         # initialize data storage
         self.temperature_out = None
         self.sunpower = None
         self.power_values = []
         self.desired_states = []
+        self.state_store = create_state_store(self.config)
+        self.history = create_history(self.config)
 
+        self.change_filter = create_change_filter(self.config, 'commander')
 
-    def process(self):
+        # setup OPC output of the desired states as one control word
+        self.tag_command = None
+        if self.config['OPC_STORAGE']['enabled'] and self.config['OPC_STORAGE'].get('tag_command'):
+            self.tag_command = self.config['OPC_STORAGE']['tag_command']
+            self.opcclient = get_opc_client(self.config)
+            self.codec = create_control_codec(self.config)
+
+        # setup mqtt connection
+        if self.config['MQTT_STORAGE']['enabled']:
+            self.mqtt = get_mqtt_sink(self.config)
+
+
+    def process(self, power_values=None, store_file=True):
         try:
             # read power values
-            # we just support file storage
-            self.read_file()
+            # we just support file storage, unless given by a hosting pipeline
+            if power_values is None:
+                self.read_file()
+            else:
+                self.read_weather()
+                self.power_values[:] = power_values
             
             # clear result array, if already filled
             del self.desired_states[:]
@@ -45,8 +68,15 @@ class Commander(StandardScript):
                 self.desired_states.append(desired_state)
             
             # store desired states
-            # we just support file storage
-            self.save_file()
+            if self.tag_command is not None:
+                self.save_opc()
+            if self.config['MQTT_STORAGE']['enabled']:
+                self.save_mqtt()
+            if store_file:
+                self.save_file()
+            if self.history is not None:
+                self.history.append('commander', [window['name'] for window in self.config['WINDOWS']],
+                                    self.desired_states)
 
         except Exception as e:
             logging.getLogger().error(traceback.format_exc())
@@ -61,47 +91,62 @@ class Commander(StandardScript):
                (window_power >= self.config['CONTROL']['angle_threshold'])
 
 
-    def read_file(self):
-        config = configparser.ConfigParser()
-        try:
-            config.read(self.config['FILE_STORAGE']['filename'])
-        except configparser.ParsingError as e:
-            logging.getLogger().error("Error parsing file storage: " + str(e))
+    def read_weather(self):
+        temperature_out, sunpower = self.state_store.read_values('zamg', ['Temperature', 'SunPower'])
+        if temperature_out is None or sunpower is None:
+            raise KeyError("No zamg data present in file storage.")
+        self.temperature_out = float(temperature_out)
+        self.sunpower        = float(sunpower)
+
 
-        self.temperature_out = float(config['zamg']['Temperature'])
-        self.sunpower        = float(config['zamg']['SunPower'])
+    def read_file(self):
+        self.read_weather()
 
         # clear result array, if already filled
         del self.power_values[:]
         # process desired states
-        for window in self.config['WINDOWS']:
-            try:
-                cur_power = float(config['sunpower'][window['name']])
-            except KeyError:
+        power_values = self.state_store.read_values(
+            'sunpower', [window['name'] for window in self.config['WINDOWS']])
+        for window, cur_power in zip(self.config['WINDOWS'], power_values):
+            if cur_power is None:
                 logging.getLogger().error("No power value present for {}."\
                                 .format(window['name']))
                 cur_power = 0
-            self.power_values.append(cur_power)
+            self.power_values.append(float(cur_power))
 
 
-    def save_file(self):
-        config = configparser.ConfigParser()
-        # read existing file data
-        if os.path.isfile(self.config['FILE_STORAGE']['filename']):
-            try:
-                config.read(self.config['FILE_STORAGE']['filename'])
-            except configparser.ParsingError as e:
-                logging.getLogger().error("Error parsing file storage: " + str(e))
-            
+    def get_file_values(self):
         # recreate data of this script
-        config[self.scriptname] = {}
+        values = {}
         for i in range(len(self.config['WINDOWS'])):
-            config[self.scriptname][self.config['WINDOWS'][i]['name']] = \
-                                        str(int(self.desired_states[i]))
+            values[self.config['WINDOWS'][i]['name']] = str(int(self.desired_states[i]))
+        return values
+
+
+    def save_opc(self):
+        # write all states as single control word, if changed
+        word = self.codec.encode(self.desired_states)
+        keys, opc_tags, values, types = self.change_filter.select_changed(
+            'opc:', [self.tag_command], [word], [self.codec.opc_type])
+        if len(opc_tags) > 0:
+            self.opcclient.write(opc_tags, types, values)
+            self.change_filter.commit(keys, values)
+
 
+    def save_mqtt(self):
+        # publish changed desired states
+        keys, topics, values = self.change_filter.select_changed(
+            'mqtt:' + self.mqtt.prefix, self.mqtt.window_topics(self.config['WINDOWS'], 'desired'),
+            [int(state) for state in self.desired_states])
+        for topic, value in zip(topics, values):
+            self.mqtt.publish(topic, value)
+        if len(topics) and self.mqtt.flush():
+            self.change_filter.commit(keys, values)
+
+
+    def save_file(self):
         # save data file
-        with open(self.config['FILE_STORAGE']['filename'], 'w') as configfile:
-            config.write(configfile)
+        self.state_store.write_section('commander', self.get_file_values())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import logging
+import traceback
+import time
+import signal
+
+# self-defined modules
+from blindctrl.shared.stdscript import StandardScript
+from blindctrl.shared.clients import get_opc_client
+from blindctrl.remote.remotectrl import RemoteCtrl
+
+
+usage = """\
+Usage: {name}
+
+Holds an OPC subscription of OPC_STORAGE.tag_control and operates the remote
+controls as soon as the control word changes.
+"""
+
+
+class ControlWatcher(StandardScript):
+    # delay before subscribing again after errors
+    RETRY_DELAY = 10    # seconds
+
+    def __init__(self, config=None):
+        # call parent constructor
+        super().__init__(config)
+
+        if not self.config['OPC_STORAGE']['enabled'] or not self.config['OPC_STORAGE']['tag_control']:
+            raise Exception("ControlWatcher needs OPC storage with tag_control enabled")
+        storage = self.config['OPC_STORAGE']
+        self.tag = storage['tag_control']
+        self.sampling_rate = storage.get('sampling_rate', 1000)
+        self.wait_time = storage.get('wait_time', 1000)
+
+        self.opcclient = get_opc_client(self.config)
+        self.remote_ctrl = RemoteCtrl(self.config)
+        self.handle = None
+        self.stopped = False
+
+    def subscribe(self):
+        # the server drops the subscription if we miss several polls
+        self.handle, values = self.opcclient.subscribe(
+            [self.tag], self.sampling_rate, 4 * (self.wait_time + self.sampling_rate))
+        logging.getLogger().info("Subscribed to {}".format(self.tag))
+        return values[0]
+
+    def on_change(self, value):
+        logging.getLogger().info("Control word changed: {}".format(value))
+        try:
+            desired_states = self.remote_ctrl.state_ctrl.decode_control(value)
+        except ValueError as e:
+            # wait for the next change, resubscribing would get the same word
+            logging.getLogger().error(str(e))
+            return
+        # compare with the latest states, e.g. of remotectrl run by cron
+        self.remote_ctrl.process_latest(desired_states)
+
+    def stop(self, *args):
+        self.stopped = True
+
+    def run(self):
+        while not self.stopped:
+            try:
+                if self.handle is None:
+                    # initial values are processed like changes
+                    value = self.subscribe()
+                    if value is not None:
+                        self.on_change(value)
+
+                changes = self.opcclient.poll(self.handle, self.wait_time)
+                if changes is None:
+                    # subscription lost, e.g. on server restart
+                    self.handle = None
+                elif 0 in changes and changes[0] is not None:
+                    self.on_change(changes[0])
+
+            except Exception:
+                logging.getLogger().error(traceback.format_exc())
+                self.handle = None
+                time.sleep(self.RETRY_DELAY)
+
+        if self.handle is not None:
+            self.opcclient.cancel(self.handle)
+
+
+def main():
+    """entry point if called as an executable"""
+    # init functionality
+    watcher = ControlWatcher()
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    # react on control word changes until stopped
+    watcher.run()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        # main entry point
+        main()
+    else:
+        print(usage.format(name="ctrlwatch"))
@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import logging
+import traceback
+import time
+import signal
+import threading
+
+# self-defined modules
+from blindctrl.shared.stdscript import StandardScript
+from blindctrl.shared.mqttsink import MqttSink, get_mqtt_sink
+from blindctrl.remote.remotectrl import RemoteCtrl
+
+
+usage = """\
+Usage: {name}
+
+Subscribes to <prefix>window/<name>/set of MQTT_STORAGE and operates the
+remote controls on commands. Characters / + # of window names are replaced
+by _ in topics. Payloads are 1, down, on or true for down and
+0, up, off or false for up. Commands arriving within MQTT_STORAGE.debounce
+seconds are coalesced, only the last one per window is executed. Pending
+commands are executed at the latest MQTT_STORAGE.debounce_max seconds after
+the first of them.
+"""
+
+
+class MqttControl(StandardScript):
+    PAYLOADS = {
+        '1': 1, 'down': 1, 'on': 1, 'true': 1,
+        '0': 0, 'up': 0, 'off': 0, 'false': 0,
+    }
+
+    def __init__(self, config=None):
+        # call parent constructor
+        super().__init__(config)
+
+        if not self.config['MQTT_STORAGE']['enabled']:
+            raise Exception("MqttControl needs MQTT storage enabled")
+        self.debounce = self.config['MQTT_STORAGE'].get('debounce', 0.5)
+        self.debounce_max = self.config['MQTT_STORAGE'].get('debounce_max', 5)
+        # names as they appear in the topics
+        self.windows = {MqttSink.topic_level(window['name']): i
+                        for i, window in enumerate(self.config['WINDOWS'])}
+
+        self.remote_ctrl = RemoteCtrl(self.config)
+        self.mqtt = get_mqtt_sink(self.config)
+
+        # pending commands as window index: state
+        self.pending = {}
+        self.first_command = 0
+        self.last_command = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    def on_command(self, topic, payload):
+        # topic is window/<name>/set
+        name = topic[len("window/"):-len("/set")]
+        state = self.PAYLOADS.get(payload.decode(errors='replace').strip().lower())
+        if name not in self.windows or state is None:
+            logging.getLogger().warning("Invalid command {}: {!r}".format(topic, payload))
+            return
+        with self.condition:
+            # later commands of a window replace earlier ones
+            if not self.pending:
+                self.first_command = time.monotonic()
+            self.pending[self.windows[name]] = state
+            self.last_command = time.monotonic()
+            self.condition.notify()
+
+    def get_commands(self):
+        """Wait for commands and get them when no more arrived for debounce
+        seconds, but no later than debounce_max seconds after the first."""
+        with self.condition:
+            while not self.pending and not self.stopped:
+                self.condition.wait()
+            while not self.stopped:
+                # a steady stream of commands must not delay them forever
+                remaining = min(self.last_command + self.debounce,
+                                self.first_command + self.debounce_max) - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def execute(self, commands):
+        # windows without command keep their state
+        desired_states = [None] * len(self.config['WINDOWS'])
+        for index, state in commands.items():
+            desired_states[index] = state
+        logging.getLogger().info("Commands: {}".format(", ".join(
+            "{}={}".format(self.config['WINDOWS'][index]['name'], state)
+            for index, state in sorted(commands.items()))))
+        # switch from the latest states, other processes may have changed them
+        self.remote_ctrl.process_latest(desired_states)
+
+    def stop(self, *args):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def run(self):
+        self.mqtt.subscribe("window/+/set", self.on_command)
+        while not self.stopped:
+            commands = self.get_commands()
+            if not commands:
+                continue
+            try:
+                self.execute(commands)
+            except Exception:
+                # keep listening, the next command may succeed
+                logging.getLogger().error(traceback.format_exc())
+
+
+def main():
+    """entry point if called as an executable"""
+    # init functionality
+    mqtt_control = MqttControl()
+    signal.signal(signal.SIGTERM, mqtt_control.stop)
+    signal.signal(signal.SIGINT, mqtt_control.stop)
+    # execute commands until stopped
+    mqtt_control.run()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        # main entry point
+        main()
+    else:
+        print(usage.format(name="mqttctrl"))
@@ -14,6 +14,8 @@ from blindctrl.shared.stdscript import StandardScript
 from blindctrl.remote.statectrl import StateCtrl
 from blindctrl.remote.cmdctrl import CommandCtrl
 from blindctrl.remote.remotedriver import RemoteDriver
+from blindctrl.shared.deadband import create_change_filter
+from blindctrl.shared.mqttsink import get_mqtt_sink
 
 
 usage = """\
@@ -29,13 +31,18 @@ class RemoteCtrl(StandardScript):
     REMOTE_THREAD_DELAY = 2    # seconds
 
 
-    def __init__(self):
+    def __init__(self, config=None):
         # call parent constructor
-        super().__init__()
+        super().__init__(config)
         
         # initialize working classes
         self.state_ctrl = StateCtrl(self.config)
-        
+        self.change_filter = create_change_filter(self.config, 'remotectrl')
+
+        # setup mqtt connection
+        if self.config['MQTT_STORAGE']['enabled']:
+            self.mqtt = get_mqtt_sink(self.config)
+
         # setup RPi
         # don't do this in RemoteDriver because this has multiple instances
         # use P1 header pin numbering convention
@@ -44,7 +51,7 @@ class RemoteCtrl(StandardScript):
         atexit.register(GPIO.cleanup)
 
 
-    def process(self, desired_state = None):
+    def process(self, desired_state = None, store_file=True):
         try:
             # read desired state switches
             self.state_ctrl.get_switching_commands(desired_state)
@@ -77,7 +84,9 @@ class RemoteCtrl(StandardScript):
 
             # store desired states
             # we do this even if we did not switch anything to initialize the storage if needed
-            self.state_ctrl.store_desired_states()
+            self.state_ctrl.store_desired_states(store_file)
+            if self.config['MQTT_STORAGE']['enabled']:
+                self.save_mqtt()
 
         except Exception as e:
             logging.getLogger().error(traceback.format_exc())
@@ -87,12 +96,31 @@ class RemoteCtrl(StandardScript):
         return len(self.state_ctrl.cmds)
 
 
+    def process_latest(self, desired_state=None):
+        """process based on the stored current states, exclusive to other
+        processes operating the remotes, e.g. mqttctrl or a cron job"""
+        with self.state_ctrl.lock():
+            self.state_ctrl.reload_current_states()
+            return self.process(desired_state)
+
+
+    def save_mqtt(self):
+        # publish changed actual states
+        keys, topics, values = self.change_filter.select_changed(
+            'mqtt:' + self.mqtt.prefix, self.mqtt.window_topics(self.config['WINDOWS'], 'state'),
+            [int(state) for state in self.state_ctrl.current_states])
+        for topic, value in zip(topics, values):
+            self.mqtt.publish(topic, value)
+        if len(topics) and self.mqtt.flush():
+            self.change_filter.commit(keys, values)
+
+
 def main():
     # init functionality
     remote_ctrl = RemoteCtrl()
 
     # derive all desired blind states
-    remote_ctrl.process()
+    remote_ctrl.process_latest()
 
 if __name__ == "__main__":
     if len(sys.argv) == 1:
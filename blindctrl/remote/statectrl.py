@@ -2,19 +2,24 @@
 # -*- coding: iso-8859-15 -*-
 
 # standard modules
-import os
+import fcntl
 import logging
-import configparser
+import contextlib
 
 # self-defined modules
-from blindctrl.shared.opcclient import OpcClient
-from blindctrl.shared.httpclient import HttpClient
+from blindctrl.shared.clients import get_opc_client
+from blindctrl.shared.statestore import create_state_store
+from blindctrl.shared.history import create_history
+from blindctrl.shared.ctrlword import create_control_codec
 
 
 class StateCtrl:
     def __init__(self, config):
         # store configuration
         self.config = config
+        self.state_store = create_state_store(config)
+        self.history = create_history(config)
+        self.codec = create_control_codec(config)
 
         # read current blind states
         self.current_states = self._read_current_state()
@@ -28,8 +33,12 @@ class StateCtrl:
             # read desired states from file or OPC
             if self.config['OPC_STORAGE']['enabled'] and self.config['OPC_STORAGE']['tag_control']:
                 self.desired_states = self._read_opc()
+                if self.desired_states is None:
+                    # keep all windows as they are
+                    logging.getLogger().error("No control word read from OPC, skipping.")
+                    self.desired_states = [None] * len(self.config['WINDOWS'])
             else:
-                self.desired_states = self._read_desired_state()
+                self.desired_states = self._read_desired_states()
         else:
             # take commands provided via parameter
             self.desired_states = desired_state
@@ -72,82 +81,74 @@ class StateCtrl:
                 else:
                     logging.getLogger().info("Skipping command for {}.".format(window_cfg['name']))
 
-    def _read_current_state(self):
-        config = configparser.ConfigParser()
-        try:
-            config.read(self.config['FILE_STORAGE']['filename'])
-        except configparser.ParsingError as e:
-            logging.getLogger().error("Error parsing file storage: " + str(e))
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold an exclusive lock of the window states, shared by all
+        processes operating the remote controls."""
+        with open(self.config['FILE_STORAGE']['filename'] + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
+    def reload_current_states(self):
+        """Read the current states again, other processes may have switched
+        the windows since."""
+        self.current_states = self._read_current_state()
+
+    def _read_current_state(self):
         # create data array
         current_states = []
 
-        for window in self.config['WINDOWS']:
+        states = self.state_store.read_values(
+            'statectrl', [window['name'] for window in self.config['WINDOWS']])
+        for state in states:
             # process current states
-            try:
-                state = int(config['statectrl'][window['name']])
-            except KeyError:
-                state = 0
-            current_states.append(state)
+            current_states.append(int(state) if state is not None else 0)
 
         return current_states
 
     def _read_desired_states(self):
-        config = configparser.ConfigParser()
-        try:
-            config.read(self.config['FILE_STORAGE']['filename'])
-        except configparser.ParsingError as e:
-            logging.getLogger().error("Error parsing file storage: " + str(e))
-
         # create data array
         desired_states = []
 
-        for window in self.config['WINDOWS']:
+        states = self.state_store.read_values(
+            'commander', [window['name'] for window in self.config['WINDOWS']])
+        for window, state in zip(self.config['WINDOWS'], states):
             # process desired states
-            try:
-                state = int(config['commander'][window['name']])
-            except KeyError:
+            if state is None:
                 # this is an error only if we use file commands, not OPC
                 if not self.config['OPC_STORAGE']['enabled']:
                     logging.getLogger().error("No command state present for {}."
                                               .format(window['name']))
                 state = 0
-            desired_states.append(state)
+            desired_states.append(int(state))
 
         return desired_states
 
     def _read_opc(self):
-        desired_states = []
-        if "type_json" in self.config['OPC_STORAGE'] and self.config['OPC_STORAGE']['type_json']:
-            opcclient = HttpClient(self.config['OPC_STORAGE']['url'],
-                                   self.config['OPC_STORAGE']['password'])
-        else:
-            opcclient = OpcClient(self.config['OPC_STORAGE']['url'],
-                                  self.config['OPC_STORAGE']['password'])
+        opcclient = get_opc_client(self.config)
         opc_tags = [
             self.config['OPC_STORAGE']['tag_control'],
         ]
         values = opcclient.read(opc_tags)
-        value = values[0]
+        # the client reports failed reads as None
+        if values[0] is None:
+            return None
+        return self.decode_control(values[0])
 
-        for i in range(len(self.config['WINDOWS'])):
-            # process current state
-            ctrl_id = self.config['WINDOWS'][i]['opc']['ctrl']
-            # opc reading may be disabled for this window
-            if ctrl_id is not None:
-                try:
-                    state = int(value[2*ctrl_id:2*ctrl_id+2])
-                except KeyError:
-                    logging.getLogger().error("Error getting state for window {}, {}"
-                                              .format(ctrl_id, self.config['WINDOWS'][i]['name']))
-                    state = 0
-            else:
-                state = None
-            desired_states.append(state)
+    def decode_control(self, value):
+        """Get the desired window states of the OPC control word."""
+        return self.codec.decode(value)
 
-        return desired_states
+    def get_file_values(self):
+        values = {}
+        for i in range(len(self.config['WINDOWS'])):
+            values[self.config['WINDOWS'][i]['name']] = str(int(self.current_states[i]))
+        return values
 
-    def store_desired_states(self):
+    def store_desired_states(self, store_file=True):
         # update class member
         has_changed = False
         for i in range(len(self.config['WINDOWS'])):
@@ -156,23 +157,13 @@ class StateCtrl:
                 has_changed = True
                 self.current_states[i] = self.desired_states[i]
 
-        if has_changed:
+        if has_changed and store_file:
             # update file storage
-            config = configparser.ConfigParser()
-            # read existing file data
-            if os.path.isfile(self.config['FILE_STORAGE']['filename']):
-                try:
-                    config.read(self.config['FILE_STORAGE']['filename'])
-                except configparser.ParsingError as e:
-                    logging.getLogger().error("Error parsing file storage: " + str(e))
-
-            # recreate data of this script
-            config['statectrl'] = {}
-            for i in range(len(self.config['WINDOWS'])):
-                # store in file
-                config['statectrl'][self.config['WINDOWS'][i]['name']] = \
-                    str(int(self.current_states[i]))
-
-            # save data file
-            with open(self.config['FILE_STORAGE']['filename'], 'w') as configfile:
-                config.write(configfile)
+            self.state_store.write_section('statectrl', self.get_file_values())
+
+        # record actual states of every run
+        if self.history is not None:
+            self.history.append('statectrl', [window['name'] for window in self.config['WINDOWS']],
+                                self.current_states)
+
+        return has_changed
@@ -0,0 +1 @@
+"""This module runs the processing stages within long-lived processes."""
@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import logging
+import traceback
+import asyncio
+import signal
+
+# self-defined modules
+from blindctrl.shared.stdscript import StandardScript
+
+
+usage = """\
+Usage: {name}
+
+Runs zamg, sunpower, commander, remotectrl and astrotime within one long-lived
+process, optionally with sunpower, commander and remotectrl chained in memory.
+The stage intervals are configured in the DAEMON section.
+"""
+
+
+class BlindCtrlDaemon(StandardScript):
+    # default stage intervals in seconds, 0 disables a stage
+    # pipeline chains sunpower, commander and remotectrl in memory and
+    # replaces these stages if enabled
+    DEFAULTS = {
+        'zamg': 900,
+        'pipeline': 0,
+        'sunpower': 60,
+        'commander': 60,
+        'remotectrl': 60,
+        'astrotime': 86400,
+    }
+
+    def __init__(self, config=None):
+        # call parent constructor
+        super().__init__(config)
+
+        self.intervals = dict(self.DEFAULTS, **self.config.get('DAEMON', {}))
+        # stage instances, created once and kept for the process lifetime
+        self.stages = {}
+        # stages share the data file, so run one at a time
+        self.lock = None
+        self.stopped = None
+
+
+    def setup_stages(self):
+        # import here to load only the modules of enabled stages
+        if self.intervals['zamg']:
+            from blindctrl.zamg.zamg import Zamg
+            self.stages['zamg'] = Zamg(self.config)
+        if self.intervals['pipeline']:
+            from blindctrl.service.pipeline import Pipeline
+            self.stages['pipeline'] = Pipeline(self.config)
+            for name in ('sunpower', 'commander', 'remotectrl'):
+                self.intervals[name] = 0
+        if self.intervals['sunpower']:
+            from blindctrl.sunpower.sunpower import SunPower
+            self.stages['sunpower'] = SunPower(self.config)
+        if self.intervals['commander']:
+            from blindctrl.commander.commander import Commander
+            self.stages['commander'] = Commander(self.config)
+        if self.intervals['remotectrl']:
+            from blindctrl.remote.remotectrl import RemoteCtrl
+            self.stages['remotectrl'] = RemoteCtrl(self.config)
+        if self.intervals['astrotime'] and self.config['OPC_STORAGE']['enabled']:
+            from blindctrl.sunpower.astrotime import Astrotime
+            self.stages['astrotime'] = Astrotime(self.config)
+
+
+    def run_stage(self, name):
+        stage = self.stages[name]
+        if name == 'zamg':
+            stage.process_mail()
+            stage.process_data()
+        elif name == 'remotectrl':
+            # other processes may have switched since the last cycle
+            stage.process_latest()
+        else:
+            stage.process()
+
+
+    async def run_stage_async(self, name):
+        loop = asyncio.get_running_loop()
+        stage = self.stages[name]
+        # stages providing coroutines await their sink writes in parallel
+        if name == 'zamg':
+            await loop.run_in_executor(None, stage.process_mail)
+            await stage.process_data_async()
+        elif name == 'sunpower':
+            await stage.process_async()
+        else:
+            # stages are blocking, keep the event loop responsive
+            await loop.run_in_executor(None, self.run_stage, name)
+
+
+    async def stage_loop(self, name):
+        loop = asyncio.get_running_loop()
+        while not self.stopped.is_set():
+            start = loop.time()
+            async with self.lock:
+                try:
+                    await self.run_stage_async(name)
+                except Exception:
+                    # keep running, the next cycle may succeed
+                    logging.getLogger().error("Stage {} failed: {}".format(
+                        name, traceback.format_exc()))
+
+            # wait for next cycle or stop request
+            delay = max(self.intervals[name] - (loop.time() - start), 0)
+            try:
+                await asyncio.wait_for(self.stopped.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def run_async(self):
+        self.lock = asyncio.Lock()
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopped.set)
+
+        logging.getLogger().info("Starting stages: {}".format(", ".join(self.stages)))
+        # stages start in pipeline order since the lock is acquired in order
+        await asyncio.gather(*[self.stage_loop(name) for name in self.stages])
+        logging.getLogger().info("Stopped")
+
+
+    def run(self):
+        self.setup_stages()
+        asyncio.run(self.run_async())
+
+
+def main():
+    """entry point if called as an executable"""
+    # init functionality
+    daemon = BlindCtrlDaemon()
+    # run stages until stopped
+    daemon.run()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        # main entry point
+        main()
+    else:
+        print(usage.format(name="blindctrld"))
@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import logging
+import traceback
+import time
+
+# self-defined modules
+from blindctrl.shared.stdscript import StandardScript
+from blindctrl.sunpower.sunpower import SunPower
+from blindctrl.commander.commander import Commander
+from blindctrl.remote.remotectrl import RemoteCtrl
+
+
+usage = """\
+Usage: {name} [<interval_seconds>]
+
+Runs sunpower, commander and remotectrl back to back, passing the power values
+and desired states in memory. The data file is written once per cycle.
+If OPC_STORAGE.tag_control is configured, remotectrl follows the control word
+read from OPC instead of the desired states of commander, as when run alone.
+If <interval_seconds> is given, the cycle is repeated forever.
+"""
+
+
+class Pipeline(StandardScript):
+    def __init__(self, config=None):
+        # call parent constructor
+        super().__init__(config)
+
+        # setup stages with the shared configuration
+        self.sunpower = SunPower(self.config)
+        self.commander = Commander(self.config)
+        self.remote_ctrl = RemoteCtrl(self.config)
+
+        # an OPC control word takes precedence over the commander states
+        self.read_control = bool(self.config['OPC_STORAGE']['enabled'] and
+                                 self.config['OPC_STORAGE'].get('tag_control'))
+
+
+    def process(self):
+        try:
+            power_values = self.sunpower.process(store_file=False)
+            self.commander.process(power_values, store_file=False)
+            state_ctrl = self.remote_ctrl.state_ctrl
+            # other processes, e.g. mqttctrl, may switch meanwhile, so switch
+            # from the stored states and store ours before releasing them
+            with state_ctrl.lock():
+                state_ctrl.reload_current_states()
+                if self.read_control:
+                    # remotectrl reads the desired states from OPC
+                    self.remote_ctrl.process(store_file=False)
+                else:
+                    self.remote_ctrl.process(self.commander.desired_states, store_file=False)
+
+                # persist results of all stages at once
+                if self.config['FILE_STORAGE']['enabled']:
+                    self.sunpower.state_store.write_sections({
+                        'sunpower': self.sunpower.get_file_values(),
+                        'commander': self.commander.get_file_values(),
+                        'statectrl': state_ctrl.get_file_values(),
+                    })
+
+        except Exception as e:
+            logging.getLogger().error(traceback.format_exc())
+            raise
+
+
+    def run(self, interval):
+        while True:
+            start = time.monotonic()
+            try:
+                self.process()
+            except Exception:
+                # already logged, retry next cycle
+                pass
+            time.sleep(max(interval - (time.monotonic() - start), 0))
+
+
+def main():
+    """entry point if called as an executable"""
+    # init functionality
+    pipeline = Pipeline()
+    # run a single cycle
+    pipeline.process()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        # main entry point
+        main()
+    elif len(sys.argv) == 2:
+        Pipeline().run(float(sys.argv[1]))
+    else:
+        print(usage.format(name="blindpipe"))
@@ -0,0 +1,155 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import logging
+import traceback
+import datetime
+import time
+import numpy as np
+
+# self-defined modules
+from blindctrl.shared.stdscript import StandardScript
+from blindctrl.sunpower.powerbatch import BatchPowerCalculator
+from blindctrl.sunpower.suntable import get_sun_positions
+
+
+usage = """\
+Usage: {name} [list]
+
+Runs sunpower, commander and remotectrl exactly when the power of a window
+crosses its switching threshold, instead of polling on a fixed interval.
+"list" prints the switching times within the configured horizon.
+"""
+
+
+class CrossingFinder():
+    """Determines the times at which window powers cross the angle threshold."""
+
+    def __init__(self, config, calculator=None):
+        self.config = config
+        if calculator is None:
+            calculator = BatchPowerCalculator(config)
+        self.calculator = calculator
+
+
+    def get_margins(self, timestamps):
+        azimuth, altitude = get_sun_positions(self.calculator.latitude, self.calculator.longitude,
+                                              timestamps, self.calculator.get_sun_table())
+        return self.calculator.get_margins(azimuth, altitude,
+                                           self.config['CONTROL']['angle_threshold'])
+
+
+    def find(self, start, hours=24, step=300, tolerance=1):
+        """Get all threshold crossings within hours after start.
+
+        The margin function is sampled on a grid of step seconds to bracket
+        the roots, which are then refined by bisection to tolerance seconds.
+        Returns a sorted list of (timestamp, window index, new state)."""
+        start = start.replace(tzinfo=datetime.timezone.utc).timestamp()
+        timestamps = start + step*np.arange(int(hours*3600 // step) + 1, dtype=np.float64)
+        states = self.get_margins(timestamps) > 0
+
+        # bracket sign changes
+        time_ids, window_ids = np.nonzero(states[1:] != states[:-1])
+        low = timestamps[time_ids]
+        high = timestamps[time_ids+1]
+        low_state = states[time_ids, window_ids]
+
+        # bisect all brackets at once
+        while len(low) and np.max(high - low) > tolerance:
+            mid = (low + high) / 2
+            mid_state = self.get_margins(mid)[np.arange(len(mid)), window_ids] > 0
+            unchanged = mid_state == low_state
+            low = np.where(unchanged, mid, low)
+            high = np.where(unchanged, high, mid)
+
+        crossings = sorted(zip(high.tolist(), window_ids.tolist(), (~low_state).tolist()))
+        return crossings
+
+
+class Scheduler(StandardScript):
+    # defaults for missing SCHEDULER configuration
+    DEFAULTS = {
+        'horizon': 24,          # hours
+        'step': 300,            # seconds
+        'tolerance': 1,         # seconds
+        'max_interval': 1800,   # seconds, to follow weather changes
+        'delay': 2,             # seconds after crossing
+    }
+
+    def __init__(self, config=None):
+        # call parent constructor
+        super().__init__(config)
+
+        self.settings = dict(self.DEFAULTS, **self.config.get('SCHEDULER', {}))
+        self.finder = CrossingFinder(self.config)
+        # created on first run
+        self.pipeline = None
+
+
+    def next_run(self, now):
+        """Get the time of the next threshold crossing, limited to max_interval."""
+        crossings = self.finder.find(now, self.settings['horizon'], self.settings['step'],
+                                     self.settings['tolerance'])
+        now_timestamp = now.replace(tzinfo=datetime.timezone.utc).timestamp()
+        next_timestamp = now_timestamp + self.settings['max_interval']
+        for timestamp, window_id, state in crossings:
+            if timestamp > now_timestamp:
+                if timestamp + self.settings['delay'] < next_timestamp:
+                    logging.getLogger().info("Next crossing: {} to {} at {}".format(
+                        self.config['WINDOWS'][window_id]['name'], int(state),
+                        datetime.datetime.utcfromtimestamp(timestamp)))
+                    next_timestamp = timestamp + self.settings['delay']
+                break
+        return datetime.datetime.utcfromtimestamp(next_timestamp)
+
+
+    def run_pipeline(self):
+        # import here to keep listing independent of RPi.GPIO
+        if self.pipeline is None:
+            from blindctrl.service.pipeline import Pipeline
+            self.pipeline = Pipeline(self.config)
+        self.pipeline.process()
+
+
+    def run(self):
+        while True:
+            try:
+                self.run_pipeline()
+            except Exception:
+                # keep running; the stages already logged the error
+                logging.getLogger().error(traceback.format_exc())
+
+            now = datetime.datetime.utcnow()
+            wakeup = self.next_run(now)
+            time.sleep(max((wakeup - datetime.datetime.utcnow()).total_seconds(), 0))
+
+
+    def list(self):
+        now = datetime.datetime.utcnow()
+        crossings = self.finder.find(now, self.settings['horizon'], self.settings['step'],
+                                     self.settings['tolerance'])
+        for timestamp, window_id, state in crossings:
+            print("{}  {}: {}".format(
+                datetime.datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+                self.config['WINDOWS'][window_id]['name'], "down" if state else "up"))
+
+
+def main():
+    """entry point if called as an executable"""
+    # init functionality
+    scheduler = Scheduler()
+    # run event loop
+    scheduler.run()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        # main entry point
+        main()
+    elif sys.argv[1:] == ['list']:
+        Scheduler().list()
+    else:
+        print(usage.format(name="blindsched"))
@@ -0,0 +1,82 @@
+"""This module provides an asyncio interface to the OPC clients."""
+
+import asyncio
+import logging
+import concurrent.futures
+
+
+class AsyncOpcClient():
+    """Concurrent chunked reads and writes on top of OpcClient or HttpClient.
+
+    Tag lists are split into chunks of the client's chunk size, which are
+    requested concurrently, at most concurrency at a time. Each request must
+    complete within deadline seconds, otherwise its items count as failed.
+    read and write follow the contract of the wrapped client: read returns
+    the values, None for failed items, write returns a success flag per item."""
+
+    def __init__(self, client, concurrency=4, deadline=None):
+        self.client = client
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.chunk_size = getattr(client, 'chunk_size', None) or client.CHUNK_SIZE
+        # requests block on the socket, so run them in threads
+        # the client's socket timeouts must not exceed the deadline, otherwise
+        # requests abandoned at the deadline keep blocking their thread
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = None
+
+
+    def _chunks(self, count):
+        for offset in range(0, count, self.chunk_size):
+            yield offset, min(offset + self.chunk_size, count)
+
+
+    async def _request(self, function, *args):
+        # semaphore is bound to the running loop, create it on first use
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self.executor, function, *args), self.deadline)
+
+
+    async def read(self, opc_tags):
+        # convert potential single tag to array
+        if type(opc_tags) is not list:
+            opc_tags = [ opc_tags ]
+
+        chunks = list(self._chunks(len(opc_tags)))
+        results = await asyncio.gather(
+            *[self._request(self.client.read, opc_tags[start:end]) for start, end in chunks],
+            return_exceptions=True)
+
+        values = []
+        for (start, end), result in zip(chunks, results):
+            if isinstance(result, BaseException):
+                logging.getLogger().error("Opc read of {} items failed: {!r}".format(
+                    end-start, result))
+                result = [None] * (end-start)
+            values.extend(result)
+        return values
+
+
+    async def write(self, opc_tags, types, values):
+        chunks = list(self._chunks(len(opc_tags)))
+        results = await asyncio.gather(
+            *[self._request(self.client.write, opc_tags[start:end], types[start:end],
+                            values[start:end]) for start, end in chunks],
+            return_exceptions=True)
+
+        values_ok = []
+        for (start, end), result in zip(chunks, results):
+            if isinstance(result, BaseException):
+                logging.getLogger().error("Opc write of {} items failed: {!r}".format(
+                    end-start, result))
+                result = [False] * (end-start)
+            values_ok.extend(result)
+        return values_ok
+
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,48 @@
+"""This module provides the OPC clients shared by all stages of a process."""
+
+from blindctrl.shared.opcclient import OpcClient
+from blindctrl.shared.httpclient import HttpClient
+from blindctrl.shared.asyncclient import AsyncOpcClient
+from blindctrl.shared.transport import HttpTransport, get_transport
+
+
+# clients per (type, url, password)
+_clients = {}
+_async_clients = {}
+
+
+def _create_client(storage, transport):
+    if storage.get('type_json'):
+        return HttpClient(storage['url'], storage['password'], transport)
+    return OpcClient(storage['url'], storage['password'], transport, storage.get('chunk_size'))
+
+
+def get_opc_client(config):
+    """Get the client of the configured OPC_STORAGE, created on first use."""
+    storage = config['OPC_STORAGE']
+    key = (bool(storage.get('type_json')), storage['url'], storage['password'])
+    if key not in _clients:
+        transport = get_transport(storage.get('connect_timeout', 5),
+                                  storage.get('read_timeout', 30))
+        _clients[key] = _create_client(storage, transport)
+    return _clients[key]
+
+
+def get_async_opc_client(config):
+    """Get the asyncio client of the configured OPC_STORAGE, created on first use.
+
+    With a deadline, requests use their own transport with socket timeouts
+    not exceeding it, so requests abandoned at the deadline end as well
+    instead of blocking a worker thread up to read_timeout."""
+    storage = config['OPC_STORAGE']
+    key = (bool(storage.get('type_json')), storage['url'], storage['password'])
+    if key not in _async_clients:
+        deadline = storage.get('deadline')
+        if deadline:
+            transport = HttpTransport(min(storage.get('connect_timeout', 5), deadline),
+                                      min(storage.get('read_timeout', 30), deadline))
+            client = _create_client(storage, transport)
+        else:
+            client = get_opc_client(config)
+        _async_clients[key] = AsyncOpcClient(client, storage.get('concurrency', 4), deadline)
+    return _async_clients[key]
@@ -0,0 +1,90 @@
+"""This module encodes and decodes the window states of an OPC control word."""
+
+import logging
+import numpy as np
+
+
+class ControlCodec():
+    """Conversion between window states and a single control word.
+
+    Window i is stored at slot WINDOWS[i].opc.ctrl, windows without slot are
+    skipped on encoding and decoded as None. Supported formats are
+    "digits": two decimal digits per slot, e.g. "0100" for slot 1 down,
+    "hex": one bit per slot, packed little endian and hex encoded,
+    "int": one bit per slot, bit i of an integer for slot i.
+    Bit packed formats only represent states 0 and 1."""
+
+    FORMATS = ('digits', 'hex', 'int')
+
+    def __init__(self, windows, format='digits'):
+        if format not in self.FORMATS:
+            raise ValueError("Unknown control word format " + str(format))
+        self.format = format
+        ctrl_ids = [window['opc'].get('ctrl') for window in windows]
+        # windows with a slot and their slots
+        self.mask = np.array([ctrl_id is not None for ctrl_id in ctrl_ids], dtype=bool)
+        self.slots = np.array([ctrl_id for ctrl_id in ctrl_ids if ctrl_id is not None], dtype=np.int64)
+        self.nr_slots = int(self.slots.max()) + 1 if len(self.slots) else 0
+
+    @property
+    def opc_type(self):
+        return 'int' if self.format == 'int' else 'string'
+
+    def encode(self, states):
+        """Get the control word of all window states."""
+        words = np.zeros(self.nr_slots, dtype=np.uint8)
+        words[self.slots] = np.asarray(states)[self.mask].astype(np.uint8)
+
+        if self.format == 'digits':
+            digits = np.empty((self.nr_slots, 2), dtype=np.uint8)
+            digits[:, 0] = words // 10
+            digits[:, 1] = words % 10
+            return (digits + ord('0')).tobytes().decode('ascii')
+        packed = np.packbits(words != 0, bitorder='little').tobytes()
+        if self.format == 'hex':
+            return packed.hex()
+        return int.from_bytes(packed, 'little')
+
+    def decode(self, word):
+        """Get the states of all windows from the control word.
+
+        Raises ValueError for a missing or malformed word, e.g. digits of odd
+        number or not covering all slots. Slots beyond the end of a hex word
+        are logged as error and decoded as 0."""
+        if word is None:
+            raise ValueError("Control word missing")
+        if self.format == 'digits':
+            word = str(word)
+            if not (word.isascii() and word.isdigit()) or len(word) % 2 or \
+                    len(word) < 2 * self.nr_slots:
+                raise ValueError("Invalid control word {!r}, {} digits expected".format(
+                    word, 2 * self.nr_slots))
+            digits = np.frombuffer(word.encode('ascii'), dtype=np.uint8)
+            digits = digits.reshape(-1, 2).astype(np.int64) - ord('0')
+            words = digits[:, 0] * 10 + digits[:, 1]
+        else:
+            if self.format == 'hex':
+                packed = bytes.fromhex(str(word))
+            else:
+                value = int(word)
+                packed = value.to_bytes((value.bit_length() + 7) // 8, 'little')
+            words = np.unpackbits(np.frombuffer(packed, dtype=np.uint8),
+                                  bitorder='little').astype(np.int64)
+
+        states = np.zeros(len(self.slots), dtype=np.int64)
+        present = self.slots < len(words)
+        states[present] = words[self.slots[present]]
+        # missing leading zero bits are no error for integers
+        if self.format != 'int' and not present.all():
+            logging.getLogger().error("Control word misses slots {}".format(
+                ", ".join(str(slot) for slot in self.slots[~present][:10])))
+
+        result = [None] * len(self.mask)
+        for i, state in zip(np.flatnonzero(self.mask), states.tolist()):
+            result[i] = state
+        return result
+
+
+def create_control_codec(config):
+    """Create the codec of the control word format configured in OPC_STORAGE."""
+    return ControlCodec(config['WINDOWS'], config['OPC_STORAGE'].get('ctrl_format') or 'digits')
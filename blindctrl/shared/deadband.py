@@ -0,0 +1,108 @@
+"""This module suppresses redundant writes of unchanged values to output sinks."""
+
+import os
+import json
+import time
+import logging
+import threading
+
+
+class ChangeFilter():
+    """Change detection with per-key deadbands and a persisted cache.
+
+    A value counts as changed if it differs from the last written one by more
+    than the deadband of its key, given as {"abs": x} or {"rel": x} (relative
+    to the last value), or if the last write is older than max_age seconds.
+    Keys are prefixed with the sink, e.g. "opc:<tag>", "mqtt:<topic>" or
+    "file:<section>/<key>". Non-numeric values change on any difference.
+    If disabled, every value counts as changed."""
+
+    def __init__(self, cache_file=None, default=None, deadbands=None, max_age=None):
+        self.cache_file = cache_file
+        self.default = default or {}
+        self.deadbands = deadbands or {}
+        self.max_age = max_age
+        # last written values as {key: [value, timestamp]}
+        self.cache = {}
+        # stages may commit from several threads
+        self.lock = threading.Lock()
+        if cache_file is not None and os.path.isfile(cache_file):
+            try:
+                with open(cache_file) as cache:
+                    self.cache = json.load(cache)
+            except ValueError as e:
+                logging.getLogger().error("Error parsing deadband cache: " + str(e))
+
+
+    @property
+    def enabled(self):
+        return self.cache_file is not None
+
+
+    def changed(self, key, value, now=None):
+        if not self.enabled or key not in self.cache:
+            return True
+        last_value, last_time = self.cache[key]
+        if now is None:
+            now = time.time()
+        if self.max_age is not None and now - last_time >= self.max_age:
+            return True
+
+        try:
+            difference = abs(float(value) - float(last_value))
+        except (TypeError, ValueError):
+            return value != last_value
+        deadband = self.deadbands.get(key, self.default)
+        if 'rel' in deadband:
+            return difference > deadband['rel'] * abs(float(last_value))
+        return difference > deadband.get('abs', 0)
+
+
+    def get_changed(self, keys, values):
+        """Get the indices of all changed values."""
+        now = time.time()
+        return [i for i, (key, value) in enumerate(zip(keys, values))
+                if self.changed(key, value, now)]
+
+
+    def select_changed(self, prefix, names, values, *columns):
+        """Reduce names, values and further parallel lists to the changed
+        entries; the keys are prefix + name. Returns the keys followed by the
+        reduced lists."""
+        keys = [prefix + name for name in names]
+        changed = self.get_changed(keys, values)
+        return [[items[i] for i in changed] for items in (keys, names, values) + columns]
+
+
+    def any_changed(self, keys, values):
+        now = time.time()
+        return any(self.changed(key, value, now) for key, value in zip(keys, values))
+
+
+    def commit(self, keys, values):
+        """Record values as written and persist the cache."""
+        if not self.enabled or len(keys) == 0:
+            return
+        now = time.time()
+        with self.lock:
+            for key, value in zip(keys, values):
+                if not isinstance(value, (int, float, str, bool)) and value is not None:
+                    value = str(value)
+                self.cache[key] = [value, now]
+
+            # replace atomically
+            with open(self.cache_file + ".tmp", 'w') as cache:
+                json.dump(self.cache, cache)
+            os.replace(self.cache_file + ".tmp", self.cache_file)
+
+
+def create_change_filter(config, name):
+    """Create the change filter of stage name as configured in DEADBAND."""
+    deadband_config = config.get('DEADBAND')
+    if not deadband_config or not deadband_config['enabled']:
+        return ChangeFilter()
+    os.makedirs(deadband_config['cache_dir'], exist_ok=True)
+    return ChangeFilter(os.path.join(deadband_config['cache_dir'], name + ".json"),
+                        deadband_config.get('default'),
+                        deadband_config.get('tags'),
+                        deadband_config.get('max_age'))
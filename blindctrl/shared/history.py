@@ -0,0 +1,236 @@
+"""This module provides an append-only time series store of the stage results."""
+
+import os
+import sys
+import csv
+import json
+import math
+import time
+import fcntl
+import logging
+import datetime
+import contextlib
+import numpy as np
+
+from blindctrl.shared.stdscript import StandardScript
+
+
+usage = """\
+Usage: {name} <table> [<hours>]
+
+Prints the recorded history of <table> (sunpower, zamg, commander, statectrl)
+of the last <hours> (default 24) as CSV.
+"""
+
+
+class HistoryStore():
+    """Columnar binary history of several tables.
+
+    Every table is a fixed set of float columns. New rows are appended to
+    <table>.raw as records of a float64 timestamp and float32 values. Rows
+    older than raw_days are averaged into buckets of bucket seconds and moved
+    to <table>.agg, which keeps aggregate_days. Column names are stored in
+    <table>.json. Appends and compactions of a table are serialized by an
+    exclusive lock on <table>.lock, as several processes write the store."""
+
+    def __init__(self, directory, raw_days=7, bucket=900, aggregate_days=365):
+        self.directory = directory
+        self.raw_days = raw_days
+        self.bucket = bucket
+        self.aggregate_days = aggregate_days
+        # cached column names per table
+        self.columns = {}
+        os.makedirs(directory, exist_ok=True)
+
+
+    @staticmethod
+    def get_dtype(nr_columns):
+        return np.dtype([('time', '<f8'), ('values', '<f4', (nr_columns,))])
+
+
+    def _filename(self, table, extension):
+        return os.path.join(self.directory, table + extension)
+
+
+    @contextlib.contextmanager
+    def _lock(self, table):
+        with open(self._filename(table, ".lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def _read(self, table, extension, nr_columns):
+        filename = self._filename(table, extension)
+        dtype = self.get_dtype(nr_columns)
+        # ignore a partial last row of an interrupted append
+        count = os.path.getsize(filename) // dtype.itemsize if os.path.isfile(filename) else 0
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r', shape=(count,))
+
+
+    def _write(self, table, extension, records):
+        # replace atomically
+        filename = self._filename(table, extension)
+        records.tofile(filename + ".tmp")
+        os.replace(filename + ".tmp", filename)
+
+
+    def _first_time(self, table, extension):
+        filename = self._filename(table, extension)
+        if not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+            return None
+        with open(filename, 'rb') as data_file:
+            return float(np.frombuffer(data_file.read(8), dtype='<f8')[0])
+
+
+    def get_columns(self, table):
+        if table not in self.columns:
+            try:
+                with open(self._filename(table, ".json")) as header_file:
+                    self.columns[table] = json.load(header_file)['columns']
+            except OSError:
+                return None
+        return self.columns[table]
+
+
+    def _set_columns(self, table, columns):
+        # keep data of a previous column layout, e.g. after reconfiguration
+        suffix = ".{}".format(int(time.time()))
+        for extension in (".raw", ".agg", ".json"):
+            filename = self._filename(table, extension)
+            if os.path.isfile(filename):
+                os.replace(filename, filename + suffix)
+        with open(self._filename(table, ".json"), 'w') as header_file:
+            json.dump({'columns': columns}, header_file)
+        self.columns[table] = columns
+
+
+    def append(self, table, columns, values, timestamp=None):
+        """Append one row; None values are stored as NaN."""
+        columns = list(columns)
+        if timestamp is None:
+            timestamp = time.time()
+        record = np.zeros(1, dtype=self.get_dtype(len(columns)))
+        record['time'] = timestamp
+        record['values'] = [np.nan if value is None else float(value) for value in values]
+
+        with self._lock(table):
+            # another process may have changed the layout
+            self.columns.pop(table, None)
+            if self.get_columns(table) != columns:
+                if self.get_columns(table) is not None:
+                    logging.getLogger().warning("History columns of {} changed".format(table))
+                self._set_columns(table, columns)
+            with open(self._filename(table, ".raw"), 'ab') as data_file:
+                # drop a partial row of an interrupted append, it would shift all later rows
+                size = data_file.tell()
+                if size % record.itemsize:
+                    logging.getLogger().warning("Dropping partial row of history {}".format(table))
+                    data_file.truncate(size - size % record.itemsize)
+                data_file.write(record.tobytes())
+
+            # compact at most once a day
+            first = self._first_time(table, ".raw")
+            if first is not None and first < timestamp - (self.raw_days + 1)*86400:
+                self._compact(table, timestamp)
+
+
+    def compact(self, table, now=None):
+        """Downsample raw rows older than raw_days and drop expired buckets."""
+        if now is None:
+            now = time.time()
+        with self._lock(table):
+            self.columns.pop(table, None)
+            if self.get_columns(table) is not None:
+                self._compact(table, now)
+
+
+    def _compact(self, table, now):
+        # the caller holds the lock, so no rows are appended meanwhile
+        nr_columns = len(self.get_columns(table))
+        raw = np.array(self._read(table, ".raw", nr_columns))
+        # cut at bucket boundary, so buckets are never split
+        cutoff = math.floor((now - self.raw_days*86400) / self.bucket) * self.bucket
+        split = np.searchsorted(raw['time'], cutoff)
+        old, recent = raw[:split], raw[split:]
+
+        aggregated = np.array(self._read(table, ".agg", nr_columns))
+        if len(old):
+            # average per bucket, ignoring NaN
+            buckets = np.floor(old['time'] / self.bucket) * self.bucket
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+            valid = ~np.isnan(old['values'])
+            sums = np.add.reduceat(np.where(valid, old['values'], 0), starts, axis=0)
+            counts = np.add.reduceat(valid, starts, axis=0)
+            new = np.zeros(len(starts), dtype=self.get_dtype(nr_columns))
+            new['time'] = buckets[starts]
+            with np.errstate(invalid='ignore'):
+                new['values'] = sums / counts
+            aggregated = np.concatenate((aggregated, new))
+
+        # drop expired buckets
+        aggregated = aggregated[aggregated['time'] >= now - self.aggregate_days*86400]
+
+        self._write(table, ".agg", aggregated)
+        self._write(table, ".raw", recent)
+        logging.getLogger().debug("Compacted history of {}: {} rows aggregated".format(
+            table, len(old)))
+
+
+    def query(self, table, start=None, end=None):
+        """Get the rows of table within [start, end) as UTC timestamps.
+
+        Returns the column names, a timestamp array of shape (T,) and a value
+        array of shape (T,C); aggregated buckets precede raw rows."""
+        columns = self.get_columns(table)
+        if columns is None:
+            return [], np.zeros(0), np.zeros((0, 0), dtype=np.float32)
+        if start is None:
+            start = -np.inf
+        if end is None:
+            end = np.inf
+
+        parts = []
+        for extension in (".agg", ".raw"):
+            records = self._read(table, extension, len(columns))
+            # rows are sorted by time, slice by binary search
+            first, last = np.searchsorted(records['time'], [start, end])
+            parts.append(records[first:last])
+        records = np.concatenate(parts)
+        return columns, records['time'].copy(), records['values'].copy()
+
+
+def create_history(config):
+    """Create the history store configured in HISTORY; None if disabled."""
+    history_config = config.get('HISTORY')
+    if not history_config or not history_config['enabled']:
+        return None
+    return HistoryStore(history_config['directory'],
+                        history_config.get('raw_days', 7),
+                        history_config.get('bucket', 900),
+                        history_config.get('aggregate_days', 365))
+
+
+def main(table, hours):
+    script = StandardScript()
+    history = create_history(script.config)
+    if history is None:
+        raise Exception("History is not enabled")
+    columns, timestamps, values = history.query(table, time.time() - hours*3600)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['time'] + columns)
+    for timestamp, row in zip(timestamps, values):
+        date = datetime.datetime.utcfromtimestamp(timestamp)
+        writer.writerow([date.strftime("%Y-%m-%dT%H:%M:%SZ")] + ["{:g}".format(v) for v in row])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3):
+        main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 24)
+    else:
+        print(usage.format(name="history"))
@@ -1,15 +1,22 @@
 # Author: Roman Morawek <roman.morawek@embyt.com>
 
 import logging
-import urllib.request
 import ssl
 import base64
 import json
+import time
+
+from blindctrl.shared.transport import get_transport
 
 
 class HttpClient():
-    def __init__(self, url, password):
+    # number of items per request of the async client
+    CHUNK_SIZE = 1000
+
+    def __init__(self, url, password, transport=None):
         self.url = url
+        # persistent connections, shared within the process by default
+        self.transport = transport if transport is not None else get_transport()
         credentials = "operator:{}".format(password).encode()
         encoded_credentials = base64.b64encode(credentials)
         authorization = b'Basic ' + encoded_credentials
@@ -17,6 +24,8 @@ class HttpClient():
             'Content-Type': 'application/json',
             'Authorization': authorization,
         }
+        # emulated subscriptions as handle: [tags, sampling rate, last values]
+        self.subscriptions = {}
         # ignore ssl certificate errors
         self.ctx = ssl.create_default_context()
         self.ctx.check_hostname = False
@@ -36,14 +45,12 @@ class HttpClient():
             "Read": read_items,
         }
 
-        # prepare SOAP request.
-        request = urllib.request.Request(
-            self.url, json.dumps(json_body).encode(), self.http_headers)
-        result = urllib.request.urlopen(request, context=self.ctx)
+        # send request
+        response = self.transport.request(
+            self.url, json.dumps(json_body).encode(), self.http_headers, self.ctx)
 
         # parse result
         try:
-            response = result.read()
             root = json.loads(response)
             values = root["ReadResponse"]
         except Exception as exc:
@@ -70,11 +77,41 @@ class HttpClient():
             "Write": write_items,
         }
 
-        request = urllib.request.Request(
-            self.url, json.dumps(json_body).encode(), self.http_headers)
-        result = urllib.request.urlopen(request, context=self.ctx)
+        response = self.transport.request(
+            self.url, json.dumps(json_body).encode(), self.http_headers, self.ctx)
 
         # parse result
-        response = result.read()
         # print(response)
         # root = json.loads(response)
+
+        # request errors raise, so all items were accepted
+        return [True] * len(opc_tags)
+
+    def subscribe(self, opc_tags, sampling_rate=1000, ping_rate=None):
+        """Subscribe to opc_tags, with the interface of OpcClient.subscribe.
+
+        The JSON interface has no server side subscriptions, so they are
+        emulated by reads every sampling_rate ms during poll."""
+        values = self.read(list(opc_tags))
+        handle = str(len(self.subscriptions) + 1)
+        self.subscriptions[handle] = [list(opc_tags), sampling_rate, values]
+        return handle, values
+
+    def poll(self, handle, wait_time=1000):
+        """Get the changes of subscription handle within wait_time ms, as
+        dict of item index to value."""
+        if handle not in self.subscriptions:
+            return None
+        opc_tags, sampling_rate, last_values = self.subscriptions[handle]
+        deadline = time.monotonic() + wait_time / 1000
+        while True:
+            values = self.read(opc_tags)
+            changes = {i: value for i, (value, last_value) in enumerate(zip(values, last_values))
+                       if value != last_value}
+            if changes or time.monotonic() + sampling_rate / 1000 > deadline:
+                self.subscriptions[handle][2] = values
+                return changes
+            time.sleep(sampling_rate / 1000)
+
+    def cancel(self, handle):
+        self.subscriptions.pop(handle, None)
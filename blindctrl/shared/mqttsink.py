@@ -0,0 +1,142 @@
+"""This module provides the MQTT publisher shared by all stages of a process."""
+
+import re
+import time
+import atexit
+import fnmatch
+import logging
+import threading
+import paho.mqtt.client as mqtt
+
+
+class MqttSink():
+    """Batched publishing over one persistent broker connection.
+
+    Messages are queued by publish and sent together by flush, which waits
+    for their delivery at most timeout seconds. QoS and retain flags are
+    taken from MQTT_STORAGE.topics, a dict of topic patterns (fnmatch style,
+    relative to the prefix) to {"qos": x, "retain": y}, falling back to
+    MQTT_STORAGE.qos and MQTT_STORAGE.retain."""
+
+    def __init__(self, config):
+        storage = config['MQTT_STORAGE']
+        self.prefix = storage['prefix']
+        self.qos = storage.get('qos', 0)
+        self.retain = storage.get('retain', True)
+        self.topics = storage.get('topics') or {}
+        self.timeout = storage.get('timeout', 5)
+        self.queue = []
+        # subscriptions as topic: callback, renewed on reconnect
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        if 'user' in storage:
+            self.client.username_pw_set(storage['user'], storage['password'])
+        self.client.connect_async(storage['host'], storage['port'])
+        self.client.loop_start()
+        # wait for CONNACK
+        if not self.connected.wait(self.timeout):
+            logging.getLogger().error("No connection to MQTT broker {}".format(storage['host']))
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            for topic in self.subscriptions:
+                client.subscribe(topic, self.qos)
+            self.connected.set()
+        else:
+            logging.getLogger().error("MQTT connection refused: " + mqtt.connack_string(rc))
+
+    def _on_disconnect(self, client, userdata, rc):
+        # the client loop reconnects on its own
+        self.connected.clear()
+
+    def get_options(self, topic):
+        """Get QoS and retain flag of topic, relative to the prefix."""
+        for pattern, options in self.topics.items():
+            if fnmatch.fnmatchcase(topic, pattern):
+                return options.get('qos', self.qos), options.get('retain', self.retain)
+        return self.qos, self.retain
+
+    def publish(self, topic, value, qos=None, retain=None):
+        """Queue value for topic, relative to the prefix."""
+        default_qos, default_retain = self.get_options(topic)
+        with self.lock:
+            self.queue.append((self.prefix + topic, str(value),
+                               default_qos if qos is None else qos,
+                               default_retain if retain is None else retain))
+
+    def subscribe(self, topic, callback):
+        """Call callback(topic, payload) for messages of topic, relative to
+        the prefix and possibly with wildcards. The topic passed to callback
+        is relative to the prefix as well."""
+        def on_message(client, userdata, message):
+            callback(message.topic[len(self.prefix):], message.payload)
+        self.subscriptions[self.prefix + topic] = callback
+        self.client.message_callback_add(self.prefix + topic, on_message)
+        if self.connected.is_set():
+            self.client.subscribe(self.prefix + topic, self.qos)
+
+    @staticmethod
+    def topic_level(name):
+        """Get name usable as a single topic level, with the separator and
+        wildcard characters / + # replaced by _."""
+        return re.sub(r'[/+#\x00]', '_', name)
+
+    @classmethod
+    def window_topics(cls, windows, field):
+        """Get the topics window/<name>/<field> of all windows."""
+        return ["window/{}/{}".format(cls.topic_level(window['name']), field) for window in windows]
+
+    def flush(self, timeout=None):
+        """Send all queued messages and wait for their delivery, at most
+        timeout seconds. Returns False if anything may not be delivered."""
+        with self.lock:
+            queue, self.queue = self.queue, []
+        if len(queue) == 0:
+            return True
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+
+        # wait for reconnection, the client drops messages otherwise
+        if not self.connected.wait(max(deadline - time.monotonic(), 0)):
+            logging.getLogger().warning("Publishing {} MQTT messages while disconnected"
+                                        .format(len(queue)))
+        infos = [self.client.publish(topic, value, qos, retain)
+                 for topic, value, qos, retain in queue]
+
+        delivered = True
+        for info in infos:
+            try:
+                info.wait_for_publish(max(deadline - time.monotonic(), 0))
+                if not info.is_published():
+                    delivered = False
+            except (ValueError, RuntimeError):
+                # rejected by the client, e.g. while disconnected
+                delivered = False
+        if not delivered:
+            logging.getLogger().error("Not all of {} MQTT messages were delivered".format(len(infos)))
+        return delivered
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+# sinks per (host, port)
+_sinks = {}
+
+
+def get_mqtt_sink(config):
+    """Get the sink of the configured MQTT_STORAGE, created on first use.
+
+    Pending messages are flushed at exit."""
+    storage = config['MQTT_STORAGE']
+    key = (storage['host'], storage['port'])
+    if key not in _sinks:
+        _sinks[key] = MqttSink(config)
+        atexit.register(_sinks[key].close)
+    return _sinks[key]
@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import timeit
+
+# self-defined modules
+from blindctrl.shared.opcclient import OpcClient
+
+
+usage = """\
+Usage: {name} [<chunk_size>]
+
+Measures serialization and response parsing of OpcClient reads and writes
+with 100, 1k and 10k tags, without network transfer.
+"""
+
+
+RESPONSE_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<soap:Body><{name}Response xmlns="http://opcfoundation.org/webservices/XMLDA/1.0/">
+<{name}Result RcvTime="2024-01-01T00:00:00" ReplyTime="2024-01-01T00:00:00" ServerState="running" />
+<RItemList>{items}</RItemList>
+</{name}Response></soap:Body></soap:Envelope>"""
+
+
+class ReplayTransport():
+    """Transport returning prepared responses, one per chunk in turn."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.count = 0
+
+    def request(self, url, body, headers, context=None):
+        response = self.responses[self.count % len(self.responses)]
+        self.count += 1
+        return response
+
+
+def create_responses(name, nr_tags, chunk_size):
+    responses = []
+    for offset in range(0, nr_tags, chunk_size):
+        items = "".join(['<Items ItemName="Tag{0}" ClientItemHandle="{0}">'
+                         '<Value xsi:type="xsd:float">{0}.5</Value></Items>'.format(i)
+                         for i in range(offset, min(offset+chunk_size, nr_tags))])
+        responses.append(RESPONSE_TEMPLATE.format(name=name, items=items).encode())
+    return responses
+
+
+def main(chunk_size=OpcClient.CHUNK_SIZE):
+    for nr_tags in (100, 1000, 10000):
+        tags = ["Tag{}".format(i) for i in range(nr_tags)]
+        types = ['float'] * nr_tags
+        values = [i + 0.5 for i in range(nr_tags)]
+        repetitions = max(1, 20000 // nr_tags)
+
+        read_client = OpcClient("http://localhost/DA", "", ReplayTransport(
+            create_responses("Read", nr_tags, chunk_size)), chunk_size)
+        write_client = OpcClient("http://localhost/DA", "", ReplayTransport(
+            create_responses("Write", nr_tags, chunk_size)), chunk_size)
+        assert read_client.read(tags) == ["{}.5".format(i) for i in range(nr_tags)]
+        assert all(write_client.write(tags, types, values))
+
+        time_read = timeit.timeit(lambda: read_client.read(tags), number=repetitions) / repetitions
+        time_write = timeit.timeit(lambda: write_client.write(tags, types, values),
+                                   number=repetitions) / repetitions
+        print("{:6d} tags: read {:8.2f} ms, write {:8.2f} ms ({:0.1f} us/tag)".format(
+            nr_tags, time_read*1000, time_write*1000, time_write/nr_tags*1e6))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        main()
+    elif len(sys.argv) == 2 and sys.argv[1].isdigit():
+        main(int(sys.argv[1]))
+    else:
+        print(usage.format(name="opcbench"))
@@ -1,10 +1,14 @@
 #! /usr/bin/env python
 # -*- coding: iso-8859-15 -*-
 
+import io
+import datetime
 import logging
-import urllib.request
 import base64
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+from blindctrl.shared.transport import get_transport
 
 
 class OpcClient():
@@ -42,9 +46,64 @@ class OpcClient():
     	</soap:Envelope>
     """
 
+    SOAP_TEMPLATE_SUBSCRIBE="""
+        <?xml version="1.0" encoding="utf-8"?>
+    	<soap:Envelope
+    		xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    		xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+    		xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+    		<soap:Body>
+    			<Subscribe xmlns="http://opcfoundation.org/webservices/XMLDA/1.0/" ReturnValuesOnReply="true" SubscriptionPingRate="{ping_rate}">
+    			  <Options ClientRequestHandle="js" LocaleID="en-US" />
+    			  <ItemList>
+    				{items}
+    			  </ItemList>
+    			</Subscribe>
+    		</soap:Body>
+    	</soap:Envelope>
+    """
+
+    SOAP_TEMPLATE_REFRESH="""
+        <?xml version="1.0" encoding="utf-8"?>
+    	<soap:Envelope
+    		xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    		xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+    		xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+    		<soap:Body>
+    			<SubscriptionPolledRefresh xmlns="http://opcfoundation.org/webservices/XMLDA/1.0/" HoldTime="{hold_time}" WaitTime="{wait_time}" ReturnAllItems="false">
+    			  <Options ClientRequestHandle="js" LocaleID="en-US" />
+    			  <ServerSubHandles>{handle}</ServerSubHandles>
+    			</SubscriptionPolledRefresh>
+    		</soap:Body>
+    	</soap:Envelope>
+    """
 
-    def __init__(self, url, password):
+    SOAP_TEMPLATE_CANCEL="""
+        <?xml version="1.0" encoding="utf-8"?>
+    	<soap:Envelope
+    		xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    		xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+    		xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+    		<soap:Body>
+    			<SubscriptionCancel xmlns="http://opcfoundation.org/webservices/XMLDA/1.0/" ServerSubHandle="{handle}" ClientRequestHandle="js" />
+    		</soap:Body>
+    	</soap:Envelope>
+    """
+
+    # precompiled item templates; the item index is used as ClientItemHandle
+    READ_ITEM = '<Items ItemName={} ClientItemHandle="{}" />'
+    SUBSCRIBE_ITEM = '<Items ItemName={} ClientItemHandle="{}" RequestedSamplingRate="{}" />'
+    WRITE_ITEM = '<Items ItemName={} ClientItemHandle="{}"><Value xsi:type="{}">{}</Value></Items>'
+
+    # default number of items per request
+    CHUNK_SIZE = 1000
+
+
+    def __init__(self, url, password, transport=None, chunk_size=None):
         self.url = url
+        # persistent connections, shared within the process by default
+        self.transport = transport if transport is not None else get_transport()
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
 
         credentials = "operator:{}".format(password).encode()
         encoded_credentials = base64.b64encode(credentials)
@@ -55,36 +114,76 @@ class OpcClient():
             'SOAPAction': '/DA'
         }
 
+        # split envelopes once around the item list
+        self.read_envelope = self.SOAP_TEMPLATE_READ.strip().split("{items}")
+        self.write_envelope = self.SOAP_TEMPLATE_WRITE.strip().split("{items}")
+
+
+    def build_read(self, opc_tags, offset=0):
+        """Serialize a Read request; handles start at offset."""
+        items = "".join([self.READ_ITEM.format(quoteattr(tag), offset+i)
+                         for i, tag in enumerate(opc_tags)])
+        return (self.read_envelope[0] + items + self.read_envelope[1]).encode()
+
+
+    def build_write(self, opc_tags, types, values, offset=0):
+        """Serialize a Write request; handles start at offset."""
+        items = "".join([self.WRITE_ITEM.format(quoteattr(tag), offset+i, value_type, escape(str(value)))
+                         for i, (tag, value_type, value) in enumerate(zip(opc_tags, types, values))])
+        return (self.write_envelope[0] + items + self.write_envelope[1]).encode()
+
+
+    @staticmethod
+    def parse_items(response, offset=0, item_tag='Items'):
+        """Parse the item list of a Read or Write response incrementally.
+
+        Returns a dict of ClientItemHandle to value text; the value is None
+        if the item has no Value, e.g. on errors. Servers not returning
+        handles are matched by position, starting at offset. Subscribe
+        responses wrap each value in an ItemValue element, given as item_tag."""
+        results = {}
+        position = offset
+        for event, element in ET.iterparse(io.BytesIO(response), events=('end',)):
+            tag = element.tag.rpartition('}')[2]
+            if tag == item_tag:
+                handle = element.get('ClientItemHandle', str(position))
+                position += 1
+                value = None
+                for child in element:
+                    if child.tag.rpartition('}')[2] == 'Value':
+                        value = child.text or ''
+                        break
+                results[handle] = value
+                # free parsed items
+                element.clear()
+        return results
+
+
+    def _chunks(self, count):
+        for offset in range(0, count, self.chunk_size):
+            yield offset, min(offset + self.chunk_size, count)
+
 
     def read(self, opc_tags, callback=None, callback_arguments=None, error_callback=None):
         # convert potential single tag to array
         if type(opc_tags) is not list:
             opc_tags = [ opc_tags ]
 
-    	# build opc item query string
-        opc_string = ""
-        for tag in opc_tags:
-            opc_string += '<Items ItemName="{}" />'.format(tag)
-
-    	# create our SOAP body content based off of the template.
-        msg_body = self.SOAP_TEMPLATE_READ.format(items=opc_string).strip()
-
-    	# prepare SOAP request.
-        request = urllib.request.Request(self.url, msg_body.encode(), self.http_headers)
-        result = urllib.request.urlopen(request)
-
-        # parse result
-        response = result.read()
-        root = ET.fromstring(response)
-        item_list = root[0][0][1]
-        values = []
-        for item in item_list:
-            if len(item):
-                values.append(item[0].text)
-            else:
-                # probably inexisting opc item
-                logging.getLogger().error("Opc read error.")
-                values.append(None)
+        values = [None] * len(opc_tags)
+        for start, end in self._chunks(len(opc_tags)):
+            # send SOAP request.
+            msg_body = self.build_read(opc_tags[start:end], start)
+            response = self.transport.request(self.url, msg_body, self.http_headers)
+
+            # parse result, matched by handle
+            results = self.parse_items(response, start)
+            for i in range(start, end):
+                values[i] = results.get(str(i))
+
+        errors = [opc_tags[i] for i in range(len(opc_tags)) if values[i] is None]
+        if errors:
+            # probably inexisting opc item
+            logging.getLogger().error("Opc read error: {}".format(", ".join(errors[:10])))
 
 		# call notification handler
         #callback(values, callback_arguments)
@@ -92,27 +191,67 @@ class OpcClient():
 
 
     def write(self, opc_tags, types, values, callback=None, callback_arguments=None, error_callback=None):
-        # build message body
-        opc_string = ""
-        for i in range(len(opc_tags)):
-            logging.getLogger().debug("writing {}={}".format(opc_tags[i], values[i]))
-            opc_string += '<Items ItemName="{tag}" ClientItemHandle="{tag}">'.format(tag=opc_tags[i])
-            opc_string += '<Value xsi:type="{}">'.format(types[i])
-            opc_string += str(values[i])
-            opc_string += '</Value>'
-            opc_string += '</Items>'
-        msg_body = self.SOAP_TEMPLATE_WRITE.format(items=opc_string).strip()
-
-        request = urllib.request.Request(self.url, msg_body.encode(), self.http_headers)
-        result = urllib.request.urlopen(request)
-
-        # parse result
-        response = result.read()
-        #print(response)
-        root = ET.fromstring(response)
-        item_list = root[0][0][1]
-        values_ok = []
-        for i in range(len(item_list)):
+        logging.getLogger().debug("writing {} opc items".format(len(opc_tags)))
+        values_ok = [False] * len(opc_tags)
+        for start, end in self._chunks(len(opc_tags)):
+            msg_body = self.build_write(opc_tags[start:end], types[start:end], values[start:end], start)
+            response = self.transport.request(self.url, msg_body, self.http_headers)
+
+            # parse result
             # if the item contains a subnode (with "Value" tag) the command succeded
-            if len(item_list[i]) == 0:
-                logging.getLogger().error("Error writing {}.".format(opc_tags[i]))
+            results = self.parse_items(response, start)
+            for i in range(start, end):
+                values_ok[i] = results.get(str(i)) is not None
+
+        errors = [opc_tags[i] for i in range(len(opc_tags)) if not values_ok[i]]
+        if errors:
+            logging.getLogger().error("Error writing {}.".format(", ".join(errors[:10])))
+        return values_ok
+
+
+    def subscribe(self, opc_tags, sampling_rate=1000, ping_rate=10000):
+        """Subscribe to opc_tags, sampled every sampling_rate ms.
+
+        The server drops the subscription if not polled within ping_rate ms.
+        Returns the server subscription handle and the initial values."""
+        items = "".join([self.SUBSCRIBE_ITEM.format(quoteattr(tag), i, sampling_rate)
+                         for i, tag in enumerate(opc_tags)])
+        msg_body = self.SOAP_TEMPLATE_SUBSCRIBE.strip().format(
+            ping_rate=ping_rate, items=items).encode()
+        response = self.transport.request(self.url, msg_body, self.http_headers)
+
+        # the handle is an attribute of the response element
+        handle = None
+        for event, element in ET.iterparse(io.BytesIO(response), events=('start',)):
+            if element.tag.rpartition('}')[2] == 'SubscribeResponse':
+                handle = element.get('ServerSubHandle')
+                break
+        if handle is None:
+            raise Exception("Opc subscription of {} failed".format(", ".join(opc_tags[:10])))
+
+        results = self.parse_items(response, item_tag='ItemValue')
+        return handle, [results.get(str(i)) for i in range(len(opc_tags))]
+
+
+    def poll(self, handle, wait_time=1000):
+        """Get the changes of subscription handle.
+
+        The server returns as soon as any item changed, at the latest after
+        wait_time ms. Returns a dict of item index to value, empty if nothing
+        changed, or None if the server does not know the subscription any
+        more, e.g. after a restart."""
+        hold_time = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        msg_body = self.SOAP_TEMPLATE_REFRESH.strip().format(
+            hold_time=hold_time, wait_time=wait_time, handle=escape(handle)).encode()
+        response = self.transport.request(self.url, msg_body, self.http_headers)
+
+        for event, element in ET.iterparse(io.BytesIO(response), events=('end',)):
+            if element.tag.rpartition('}')[2] == 'InvalidServerSubHandles':
+                logging.getLogger().warning("Opc subscription {} expired".format(handle))
+                return None
+        return {int(index): value for index, value in self.parse_items(response).items()}
+
+
+    def cancel(self, handle):
+        msg_body = self.SOAP_TEMPLATE_CANCEL.strip().format(handle=escape(handle, {'"': '&quot;'})).encode()
+        self.transport.request(self.url, msg_body, self.http_headers)
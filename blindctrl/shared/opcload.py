@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import time
+import logging
+import concurrent.futures
+import numpy as np
+
+# self-defined modules
+from blindctrl.shared.opcclient import OpcClient
+from blindctrl.shared.httpclient import HttpClient
+from blindctrl.shared.transport import HttpTransport
+from blindctrl.shared.opcserver import StandInServer
+
+
+usage = """\
+Usage: {name} [xml|json [<tags> [<requests> [<threads> [<latency_ms> [<error_rate>]]]]]]
+
+Drives OpcClient (xml, default) or HttpClient (json) against a local stand-in
+server. <requests> (default 200) alternating reads and writes of <tags>
+(default 100) tags each are issued from <threads> (default 4) threads. The
+server delays responses by <latency_ms> (default 0) and fails the given
+fraction of requests (default 0). Reports throughput and latency percentiles.
+"""
+
+
+def run_load(client_type='xml', nr_tags=100, nr_requests=200, threads=4,
+             latency=0, error_rate=0):
+    """Run the load test and get the statistics as dict."""
+    server = StandInServer(0, max(nr_tags, 1), latency, 0, error_rate)
+    server.start()
+    transport = HttpTransport(max_idle=threads)
+    if client_type == 'json':
+        client = HttpClient(server.url, "", transport)
+    else:
+        client = OpcClient(server.url, "", transport)
+
+    tags = ["Tag{}".format(i) for i in range(nr_tags)]
+    types = ['float'] * nr_tags
+    values = [i + 0.5 for i in range(nr_tags)]
+
+    def request(index):
+        start = time.perf_counter()
+        try:
+            if index % 2:
+                client.write(tags, types, values)
+            else:
+                client.read(tags)
+            failed = False
+        except Exception:
+            failed = True
+        return time.perf_counter() - start, failed
+
+    # client item errors are expected with error injection
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try:
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(request, range(nr_requests)))
+        duration = time.perf_counter() - start
+    finally:
+        logger.setLevel(level)
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+    latencies = np.array([result[0] for result in results]) * 1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        'requests': nr_requests,
+        'errors': sum(result[1] for result in results),
+        'duration': duration,
+        'requests_per_s': nr_requests / duration,
+        'tags_per_s': nr_requests * nr_tags / duration,
+        'p50': p50,
+        'p90': p90,
+        'p99': p99,
+        'max': latencies.max(),
+    }
+
+
+def main(client_type='xml', nr_tags=100, nr_requests=200, threads=4, latency_ms=0, error_rate=0):
+    stats = run_load(client_type, nr_tags, nr_requests, threads, latency_ms/1000, error_rate)
+    print("{} client, {} tags, {} threads: {} requests, {} errors in {:0.2f} s".format(
+        client_type, nr_tags, threads, stats['requests'], stats['errors'], stats['duration']))
+    print("throughput: {:0.1f} requests/s, {:0.0f} tags/s".format(
+        stats['requests_per_s'], stats['tags_per_s']))
+    print("latency: p50 {:0.2f} ms, p90 {:0.2f} ms, p99 {:0.2f} ms, max {:0.2f} ms".format(
+        stats['p50'], stats['p90'], stats['p99'], stats['max']))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 7 and (len(sys.argv) == 1 or sys.argv[1] in ('xml', 'json')):
+        try:
+            arguments = [sys.argv[1] if len(sys.argv) > 1 else 'xml'] + \
+                [int(argument) for argument in sys.argv[2:5]] + \
+                [float(argument) for argument in sys.argv[5:7]]
+        except ValueError:
+            print(usage.format(name="opcload"))
+        else:
+            main(*arguments)
+    else:
+        print(usage.format(name="opcload"))
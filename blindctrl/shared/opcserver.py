@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import io
+import json
+import time
+import random
+import logging
+import threading
+import http.server
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+
+usage = """\
+Usage: {name} [<port> [<nr_tags> [<latency_ms> [<error_rate>]]]]
+
+Runs a local stand-in OPC server on <port> (default 8080) speaking the
+XML-DA Read/Write subset of OpcClient and the JSON format of HttpClient.
+It serves the tags Tag0 .. Tag<nr_tags-1> (default 1000), delays each
+response by <latency_ms> (default 0) and fails the given fraction of
+requests with HTTP 500 (default 0).
+"""
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """In-memory tag server for offline tests of the OPC clients.
+
+    Unknown tags are reported as item errors, as by a real server."""
+
+    daemon_threads = True
+
+    RESPONSE_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+<soap:Body><{name}Response xmlns="http://opcfoundation.org/webservices/XMLDA/1.0/">
+<{name}Result ServerState="running" />
+<RItemList>{items}</RItemList>
+</{name}Response></soap:Body></soap:Envelope>"""
+
+    VALUE_ITEM = '<Items ItemName={} ClientItemHandle={}><Value xsi:type="xsd:string">{}</Value></Items>'
+    ERROR_ITEM = '<Items ItemName={} ClientItemHandle={} ResultID="E_UNKNOWNITEMNAME" />'
+
+    def __init__(self, port=8080, nr_tags=1000, latency=0, jitter=0, error_rate=0):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tags = {"Tag{}".format(i): "0" for i in range(nr_tags)}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/DA".format(self.server_address[1])
+
+    def start(self):
+        """Serve in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def failing(self):
+        return self.error_rate and random.random() < self.error_rate
+
+    def handle_xml(self, body):
+        # collect request items
+        name = None
+        items = []
+        for event, element in ET.iterparse(io.BytesIO(body), events=('start', 'end')):
+            tag = element.tag.rpartition('}')[2]
+            if event == 'start' and tag in ('Read', 'Write'):
+                name = tag
+            elif event == 'end' and tag == 'Items':
+                value = None
+                for child in element:
+                    if child.tag.rpartition('}')[2] == 'Value':
+                        value = child.text or ''
+                items.append((element.get('ItemName'), element.get('ClientItemHandle', ''), value))
+                element.clear()
+        if name is None:
+            return None
+
+        result = []
+        with self.lock:
+            for tag, handle, value in items:
+                if tag not in self.tags:
+                    result.append(self.ERROR_ITEM.format(quoteattr(tag or ''), quoteattr(handle)))
+                    continue
+                if name == 'Write':
+                    self.tags[tag] = value
+                result.append(self.VALUE_ITEM.format(quoteattr(tag), quoteattr(handle),
+                                                     escape(self.tags[tag])))
+        return self.RESPONSE_TEMPLATE.format(name=name, items="".join(result)).encode()
+
+    def handle_json(self, body):
+        request = json.loads(body)
+        with self.lock:
+            if 'Read' in request:
+                return json.dumps({
+                    'ReadResponse': [self.tags.get(tag) for tag in request['Read']],
+                }).encode()
+            if 'Write' in request:
+                results = []
+                for item in request['Write']:
+                    known = item['ItemName'] in self.tags
+                    if known:
+                        self.tags[item['ItemName']] = item['Value']
+                    results.append({'ClientItemHandle': item['ClientItemHandle'],
+                                    'Result': "S_OK" if known else "E_UNKNOWNITEMNAME"})
+                return json.dumps({'WriteResponse': results}).encode()
+        return None
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    # keep connections open as the OPC clients do
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, avoid delayed ack stalls
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.requests += 1
+        self.server.delay()
+
+        response = None
+        if not self.server.failing():
+            try:
+                if 'json' in self.headers.get('Content-Type', ''):
+                    response = self.server.handle_json(body)
+                else:
+                    response = self.server.handle_xml(body)
+            except Exception as e:
+                logging.getLogger().error("Invalid request: " + str(e))
+
+        if response is None:
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json' if body[:1] == b'{' else 'text/xml')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        logging.getLogger().debug(format % args)
+
+
+def main(port=8080, nr_tags=1000, latency_ms=0, error_rate=0):
+    server = StandInServer(port, nr_tags, latency_ms/1000, 0, error_rate)
+    print("Serving {} tags on {}".format(nr_tags, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    if 1 <= len(sys.argv) <= 5:
+        try:
+            arguments = [int(sys.argv[1]) if len(sys.argv) > 1 else 8080,
+                         int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+                         float(sys.argv[3]) if len(sys.argv) > 3 else 0,
+                         float(sys.argv[4]) if len(sys.argv) > 4 else 0]
+        except ValueError:
+            print(usage.format(name="opcserver"))
+        else:
+            main(*arguments)
+    else:
+        print(usage.format(name="opcserver"))
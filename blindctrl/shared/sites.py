@@ -0,0 +1,61 @@
+"""This module provides the per-site configurations of multi-site setups."""
+
+import os
+import re
+import copy
+
+
+def _get_slug(name):
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', name)
+
+
+def _derive_paths(config, site, slug):
+    # sites are processed concurrently, so each needs its own files
+    if 'FILE_STORAGE' not in site:
+        root, extension = os.path.splitext(config['FILE_STORAGE']['filename'])
+        config['FILE_STORAGE'] = dict(config['FILE_STORAGE'],
+                                      filename="{}.{}{}".format(root, slug, extension))
+    if 'DEADBAND' not in site and config.get('DEADBAND'):
+        config['DEADBAND'] = dict(config['DEADBAND'],
+                                  cache_dir=os.path.join(config['DEADBAND']['cache_dir'], slug))
+    if 'HISTORY' not in site and config.get('HISTORY'):
+        config['HISTORY'] = dict(config['HISTORY'],
+                                 directory=os.path.join(config['HISTORY']['directory'], slug))
+
+
+def get_site_configs(config):
+    """Get a full configuration for each entry of config['SITES'].
+
+    Top level settings of a site entry (e.g. LOCATION, WINDOWS, FILE_STORAGE,
+    OPC_STORAGE, SUN_TABLE) replace the global ones. The data file, deadband
+    cache and history directory of a site are derived from its name unless
+    given. Raises an exception if sites share any of them. Without SITES,
+    the global configuration is the only site."""
+    if not config.get('SITES'):
+        return [config]
+
+    site_configs = []
+    paths = {}
+    for i, site in enumerate(config['SITES']):
+        site_config = copy.copy(config)
+        del site_config['SITES']
+        site_config.update(site)
+        if not site.get('name'):
+            raise Exception("Site {} has no name".format(i))
+        _derive_paths(site_config, site, _get_slug(site['name']))
+
+        # shared files would lose the updates of concurrent sites
+        used = [('data file', site_config['FILE_STORAGE']['filename'])]
+        if site_config.get('DEADBAND') and site_config['DEADBAND']['enabled']:
+            used.append(('deadband cache', site_config['DEADBAND']['cache_dir']))
+        if site_config.get('HISTORY') and site_config['HISTORY']['enabled']:
+            used.append(('history', site_config['HISTORY']['directory']))
+        for kind, path in used:
+            key = (kind, os.path.abspath(path))
+            if key in paths:
+                raise Exception("Sites {} and {} use the same {} {}".format(
+                    paths[key], site['name'], kind, path))
+            paths[key] = site['name']
+
+        site_configs.append(site_config)
+    return site_configs
@@ -0,0 +1,168 @@
+"""This module provides the storage backends of the shared data file."""
+
+import os
+import sys
+import abc
+import logging
+import configparser
+import sqlite3
+
+from blindctrl.shared.stdscript import StandardScript
+
+
+usage = """\
+Usage: {name} import <ini_filename>
+
+Imports an existing INI data file into the configured SQLite state store.
+"""
+
+
+class StateStore(abc.ABC):
+    """Interface of the data storage shared between the stages.
+
+    Data is organized in sections of string values, one section per stage.
+    Keys are case insensitive, as in the original INI file."""
+
+    @staticmethod
+    def normalize(key):
+        # same key transformation as configparser
+        return key.lower()
+
+    @abc.abstractmethod
+    def read_section(self, section):
+        """Get all values of section as dict; empty if not present."""
+
+    def read_values(self, section, keys):
+        """Get the values of keys in section as list; None if not present."""
+        values = self.read_section(section)
+        return [values.get(self.normalize(key)) for key in keys]
+
+    def write_section(self, section, values):
+        """Replace section with the dict values."""
+        self.write_sections({section: values})
+
+    @abc.abstractmethod
+    def write_sections(self, sections):
+        """Replace several sections, given as dict of dicts, at once."""
+
+
+class IniStateStore(StateStore):
+    """Original storage in a single INI file, rewritten on every update."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def _read(self):
+        config = configparser.ConfigParser()
+        if os.path.isfile(self.filename):
+            try:
+                config.read(self.filename)
+            except configparser.ParsingError as e:
+                logging.getLogger().error("Error parsing file storage: " + str(e))
+        return config
+
+    def read_section(self, section):
+        config = self._read()
+        if section not in config:
+            return {}
+        return dict(config[section])
+
+    def read_all(self):
+        config = self._read()
+        return {section: dict(config[section]) for section in config.sections()}
+
+    def write_sections(self, sections):
+        # read existing file data
+        config = self._read()
+
+        # recreate data of the given sections
+        for section, values in sections.items():
+            config[section] = {key: str(value) for key, value in values.items()}
+
+        # save data file
+        with open(self.filename, 'w') as configfile:
+            config.write(configfile)
+
+
+class SqliteStateStore(StateStore):
+    """Storage in an SQLite database in WAL mode.
+
+    Each update only touches the keys of one section in a single transaction
+    and rows with unchanged values are not rewritten. The connection may be
+    used by several threads as long as the accesses are serialized."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=30, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "section TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (section, key)) WITHOUT ROWID")
+
+    def read_section(self, section):
+        rows = self.connection.execute(
+            "SELECT key, value FROM state WHERE section=?", (section,))
+        return dict(rows.fetchall())
+
+    def read_values(self, section, keys):
+        # cheap point reads
+        values = []
+        for key in keys:
+            row = self.connection.execute(
+                "SELECT value FROM state WHERE section=? AND key=?",
+                (section, self.normalize(key))).fetchone()
+            values.append(row[0] if row is not None else None)
+        return values
+
+    def write_sections(self, sections):
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for section, values in sections.items():
+                rows = [(section, self.normalize(key), str(value))
+                        for key, value in values.items()]
+                cursor.executemany(
+                    "INSERT INTO state (section, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (section, key) DO UPDATE SET value=excluded.value "
+                    "WHERE value != excluded.value", rows)
+                # remove keys no longer present, e.g. of deleted windows
+                keys = [row[1] for row in rows]
+                cursor.execute(
+                    "DELETE FROM state WHERE section=? AND key NOT IN ({})".format(
+                        ",".join("?"*len(keys))), [section] + keys)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def import_ini(self, filename):
+        sections = IniStateStore(filename).read_all()
+        self.write_sections(sections)
+        return len(sections)
+
+
+def create_state_store(config):
+    """Create the state store configured in FILE_STORAGE; INI is default."""
+    storage = config['FILE_STORAGE']
+    if storage.get('backend', 'ini') == 'sqlite':
+        return SqliteStateStore(storage['filename'])
+    return IniStateStore(storage['filename'])
+
+
+def main(ini_filename):
+    script = StandardScript()
+    store = create_state_store(script.config)
+    if not isinstance(store, SqliteStateStore):
+        raise Exception("FILE_STORAGE backend is not sqlite")
+    count = store.import_ini(ini_filename)
+    logging.getLogger().info("Imported {} sections from {}".format(count, ini_filename))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == 'import':
+        main(sys.argv[2])
+    else:
+        print(usage.format(name="statestore"))
@@ -6,14 +6,19 @@ import json
 
 
 class StandardScript:
-    def __init__(self):
-        self.init_config()
+    def __init__(self, config=None):
+        self.init_config(config)
         self.init_logging()
 
 
-    def init_config(self):
+    def init_config(self, config=None):
         # extract filename
         self.scriptname = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+
+        # reuse configuration of a hosting process
+        if config is not None:
+            self.config = config
+            return
         
         # ensure existing server config file
         filename = self._checkConfigFile()
@@ -0,0 +1,119 @@
+"""This module provides a pooled HTTP transport with persistent connections."""
+
+import logging
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+
+
+class HttpTransport():
+    """POST requests over persistent keep-alive connections.
+
+    Idle connections are kept per (scheme, host, port) and reused by later
+    requests, so the TCP and TLS handshakes are only done once per host.
+    The pool may be shared between threads."""
+
+    # errors of a connection closed by the server while idle
+    STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                    ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, connect_timeout=5, read_timeout=30, max_idle=4):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle = max_idle
+        # idle connections per host
+        self.pool = {}
+        self.lock = threading.Lock()
+
+
+    def _connect(self, scheme, host, port, context):
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout,
+                                                     context=context)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        connection.connect()
+        # the connect timeout is over, further socket operations are reads
+        connection.sock.settimeout(self.read_timeout)
+        return connection
+
+
+    def _acquire(self, key):
+        with self.lock:
+            idle = self.pool.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+
+    def _release(self, key, connection):
+        with self.lock:
+            idle = self.pool.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+
+    def request(self, url, body, headers, context=None):
+        """POST body to url and get the response body.
+
+        Raises urllib.error.HTTPError for HTTP error states, as urlopen."""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        connection = self._acquire(key)
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = self._connect(parts.scheme, parts.hostname, parts.port, context)
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except self.STALE_ERRORS:
+                connection.close()
+                if not reused:
+                    raise
+                # server closed idle connection, retry once with a new one
+                logging.getLogger().debug("Reconnecting to {}".format(parts.hostname))
+                connection = None
+                reused = False
+            except Exception:
+                connection.close()
+                raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason,
+                                         response.headers, None)
+        return data
+
+
+    def close(self):
+        with self.lock:
+            for idle in self.pool.values():
+                for connection in idle:
+                    connection.close()
+            self.pool.clear()
+
+
+# transports shared by all clients of the process per (connect_timeout, read_timeout)
+_transports = {}
+
+
+def get_transport(connect_timeout=5, read_timeout=30):
+    """Get the process wide transport of the given timeouts, created on first use."""
+    key = (connect_timeout, read_timeout)
+    if key not in _transports:
+        _transports[key] = HttpTransport(connect_timeout, read_timeout)
+    return _transports[key]
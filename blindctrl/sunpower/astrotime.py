@@ -10,43 +10,66 @@ import ephem
 
 # self-defined modules
 from blindctrl.shared.stdscript import StandardScript
-from blindctrl.shared.opcclient import OpcClient
-from blindctrl.shared.httpclient import HttpClient
+from blindctrl.shared.clients import get_opc_client
+from blindctrl.sunpower.suntable import get_location, load_sun_table
+from blindctrl.sunpower.eventtable import EventTable, load_event_table
+from blindctrl.shared.deadband import create_change_filter
 
 
 usage = """\
 Usage: {name}
+       {name} build [<days>]
 
 Sets the time of local sunset to an OPC data point.
+"build" computes sunrise, sunset and twilight times for the configured
+horizons and the sun entry and exit times of all windows for <days> (default
+366) starting today, and stores them to the configured event table. If the
+event table is present, daily runs just read today's row.
 """
 
 
 class Astrotime(StandardScript):
     HORIZON = '-7'    # -6=civil twilight
+    # default horizons of the event table
+    HORIZONS = [0, -6, -7, -12, -18]
 
-    def __init__(self):
+    def __init__(self, config=None):
         # call parent constructor
-        super().__init__()
+        super().__init__(config)
+
+        # setup change detection of outputs
+        self.change_filter = create_change_filter(self.config, 'astrotime')
 
         # setup OPC interface
-        if not self.config['OPC_STORAGE']['enabled']:
-            raise Exception("Astrotime needs OPC storage enabled")
-        if "type_json" in self.config['OPC_STORAGE'] and self.config['OPC_STORAGE']['type_json']:
-            self.opcclient = HttpClient(self.config['OPC_STORAGE']['url'],
-                                        self.config['OPC_STORAGE']['password'])
-        else:
-            self.opcclient = OpcClient(self.config['OPC_STORAGE']['url'],
-                                       self.config['OPC_STORAGE']['password'])
+        self.opcclient = None
+        if self.config['OPC_STORAGE']['enabled']:
+            self.opcclient = get_opc_client(self.config)
 
     def process(self):
+        if self.opcclient is None:
+            raise Exception("Astrotime needs OPC storage enabled")
         try:
             # determine sunset
-            # get sun position
-            o = ephem.Observer()
-            # Vienna: 48 degree north; 16 degree east
-            o.lat, o.long, o.date = '48:13', '16:22', datetime.datetime.utcnow()
-            o.horizon = self.HORIZON
-            sunset = ephem.localtime(o.next_setting(ephem.Sun()))
+            now = datetime.datetime.utcnow()
+            latitude, longitude = get_location(self.config)
+            sunset = None
+            # use precomputed event table or sun table if available
+            event_table = load_event_table(self.config)
+            if event_table is not None:
+                sunset = event_table.next_setting(now, float(self.HORIZON))
+            table = None
+            if sunset is None:
+                table = load_sun_table(self.config, latitude, longitude, now)
+            if table is not None:
+                sunset = table.next_setting(now, float(self.HORIZON))
+            if sunset is not None:
+                sunset = ephem.localtime(ephem.Date(sunset))
+            else:
+                # get sun position
+                o = ephem.Observer()
+                o.lat, o.long, o.date = latitude, longitude, now
+                o.horizon = self.HORIZON
+                sunset = ephem.localtime(o.next_setting(ephem.Sun()))
             logging.getLogger().info("Setting sunset to {}".format(sunset.strftime("%H:%M:%S")))
 
             # store to OPC data point
@@ -56,6 +79,20 @@ class Astrotime(StandardScript):
             logging.getLogger().error(traceback.format_exc())
             raise
 
+    def build(self, days=366):
+        try:
+            filename = self.config.get('ASTROTIME', {}).get('event_table')
+            if not filename:
+                raise Exception("No event table configured in ASTROTIME")
+            horizons = self.config['ASTROTIME'].get('horizons', self.HORIZONS)
+            start = datetime.datetime.utcnow()
+            table = EventTable.build(self.config, start, days, horizons)
+            table.save(filename)
+
+        except Exception as e:
+            logging.getLogger().error(traceback.format_exc())
+            raise
+
     def save_opc(self, sunset):
         # setup values
         if 'tag_sunset' in self.config['OPC_STORAGE'] and \
@@ -64,8 +101,12 @@ class Astrotime(StandardScript):
             types = ['float']
             values = [sunset.hour*3600 + sunset.minute*60 + sunset.second]
 
-            # write data to OPC
-            self.opcclient.write(opc_tags, types, values)
+            # write data to OPC, if changed
+            keys, opc_tags, values, types = self.change_filter.select_changed(
+                'opc:', opc_tags, values, types)
+            if len(opc_tags):
+                self.opcclient.write(opc_tags, types, values)
+                self.change_filter.commit(keys, values)
 
 
 def main():
@@ -80,5 +121,8 @@ if __name__ == "__main__":
     if len(sys.argv) == 1:
         # main entry point
         main()
+    elif sys.argv[1] == 'build' and len(sys.argv) <= 3:
+        # build event table
+        Astrotime().build(int(sys.argv[2]) if len(sys.argv) > 2 else 366)
     else:
         print(usage.format(name="astrotime"))
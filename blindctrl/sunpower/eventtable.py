@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import json
+import math
+import logging
+import datetime
+import numpy as np
+
+# self-defined modules
+from blindctrl.sunpower.powerbatch import BatchPowerCalculator
+from blindctrl.sunpower.suntable import SunTable, get_location, get_sun_positions
+
+
+class EventTable():
+    """Daily sun events of a full period, one row per UTC day.
+
+    Each row holds the rising and setting times of the sun for several
+    horizons and the times the sun enters and leaves each window, as UTC
+    timestamps (NaN if there is no such event). The rows are stored as
+    structured .npy file, which is memory mapped on load; horizons, window
+    names and location are kept in a JSON sidecar file."""
+
+    def __init__(self, latitude, longitude, horizons, names, data):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.horizons = horizons
+        self.names = names
+        self.data = data
+
+
+    @staticmethod
+    def get_dtype(nr_horizons, nr_windows):
+        return np.dtype([
+            ('date', 'datetime64[D]'),
+            ('rise', 'f8', (nr_horizons,)),
+            ('set', 'f8', (nr_horizons,)),
+            ('entry', 'f8', (nr_windows,)),
+            ('exit', 'f8', (nr_windows,)),
+        ])
+
+
+    @staticmethod
+    def _first_crossing(values, limit, rising):
+        """Interpolated fractional index of the first crossing of limit per
+        row of values; NaN if there is none."""
+        if rising:
+            crossing = (values[:, :-1] < limit) & (values[:, 1:] >= limit)
+        else:
+            crossing = (values[:, :-1] >= limit) & (values[:, 1:] < limit)
+        found = crossing.any(axis=1)
+        index = np.argmax(crossing, axis=1)
+        rows = np.arange(len(values))
+        v0 = values[rows, index]
+        v1 = values[rows, index+1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = (limit - v0) / (v1 - v0)
+        return np.where(found, index + fraction, np.nan)
+
+
+    @classmethod
+    def build(cls, config, start, days=366, horizons=(0,), step=60, calculator=None):
+        """Compute the events of all days starting at the UTC date start."""
+        if calculator is None:
+            calculator = BatchPowerCalculator(config)
+        names = [window['name'] for window in calculator.windows]
+        per_day = int(86400 // step)
+
+        # one sun position pass over the full period, including end of last day
+        first = datetime.datetime(start.year, start.month, start.day,
+                                  tzinfo=datetime.timezone.utc).timestamp()
+        timestamps = first + step*np.arange(days*per_day + 1, dtype=np.float64)
+        azimuth, altitude = get_sun_positions(calculator.latitude, calculator.longitude,
+                                              timestamps, calculator.get_sun_table())
+
+        data = np.zeros(days, dtype=cls.get_dtype(len(horizons), len(names)))
+        data['date'] = np.datetime64(start.strftime("%Y-%m-%d"), 'D') + np.arange(days)
+
+        # day x sample matrix, each day including the first sample of the next one
+        day_ids = per_day*np.arange(days)[:, np.newaxis] + np.arange(per_day+1)
+        day_altitude = altitude[day_ids]
+        day_start = timestamps[day_ids[:, 0]]
+        for i, horizon in enumerate(horizons):
+            # upper limb crossing, as ephem's rising and setting
+            limit = math.radians(horizon - SunTable.SUN_RADIUS)
+            data['rise'][:, i] = day_start + step*cls._first_crossing(day_altitude, limit, True)
+            data['set'][:, i] = day_start + step*cls._first_crossing(day_altitude, limit, False)
+
+        # window entry and exit, day by day to bound memory
+        for day in range(days):
+            ids = day_ids[day, :-1]
+            powers = calculator.get_powers(azimuth[ids], altitude[ids])[1]
+            lit = powers > 0
+            found = lit.any(axis=0)
+            entry = np.argmax(lit, axis=0)
+            last = per_day - 1 - np.argmax(lit[::-1], axis=0)
+            data['entry'][day] = np.where(found, day_start[day] + step*entry, np.nan)
+            data['exit'][day] = np.where(found, day_start[day] + step*last, np.nan)
+
+        logging.getLogger().info("Built event table for {} days".format(days))
+        return cls(calculator.latitude, calculator.longitude, list(horizons), names, data)
+
+
+    def save(self, filename):
+        # np.save would append .npy to the name, but load opens it as given
+        with open(filename, 'wb') as data_file:
+            np.save(data_file, self.data)
+        with open(filename + ".json", 'w') as header_file:
+            json.dump({
+                'latitude': self.latitude,
+                'longitude': self.longitude,
+                'horizons': self.horizons,
+                'names': self.names,
+            }, header_file)
+
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename + ".json") as header_file:
+            header = json.load(header_file)
+        data = np.load(filename, mmap_mode='r')
+        return cls(header['latitude'], header['longitude'],
+                   header['horizons'], header['names'], data)
+
+
+    def get_row(self, date):
+        """Get the row of the UTC date or None if not covered."""
+        if len(self.data) == 0:
+            return None
+        index = int((np.datetime64(date.strftime("%Y-%m-%d"), 'D') -
+                     self.data['date'][0]).astype(np.int64))
+        if not 0 <= index < len(self.data):
+            return None
+        return self.data[index]
+
+
+    def next_setting(self, date, horizon):
+        """Get the next sun setting below horizon after date as naive UTC
+        datetime; None if not covered."""
+        if horizon not in self.horizons:
+            return None
+        horizon_id = self.horizons.index(horizon)
+        timestamp = date.replace(tzinfo=datetime.timezone.utc).timestamp()
+        for day in (date, date + datetime.timedelta(days=1)):
+            row = self.get_row(day)
+            if row is None:
+                return None
+            if row['set'][horizon_id] > timestamp:
+                return datetime.datetime.utcfromtimestamp(row['set'][horizon_id])
+        return None
+
+
+    def get_window_times(self, date, name):
+        """Get sun entry and exit of window name on the UTC date as naive UTC
+        datetimes; None if not covered or no sun."""
+        row = self.get_row(date)
+        if row is None or name not in self.names:
+            return None
+        window_id = self.names.index(name)
+        if math.isnan(row['entry'][window_id]):
+            return None
+        return (datetime.datetime.utcfromtimestamp(row['entry'][window_id]),
+                datetime.datetime.utcfromtimestamp(row['exit'][window_id]))
+
+
+def load_event_table(config):
+    """Load the configured event table; None if disabled, missing or for
+    another location."""
+    filename = config.get('ASTROTIME', {}).get('event_table')
+    if not filename:
+        return None
+    try:
+        table = EventTable.load(filename)
+    except (OSError, ValueError) as e:
+        logging.getLogger().warning("Event table not available: " + str(e))
+        return None
+    if (table.latitude, table.longitude) != get_location(config):
+        logging.getLogger().warning("Event table is for another location")
+        return None
+    return table
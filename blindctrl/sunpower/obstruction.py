@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import math
+import numpy as np
+
+
+# number of azimuth bins of the lookup raster, one per degree
+RESOLUTION = 360
+
+
+def has_obstruction(window):
+    return 'horizon' in window['geo'] or 'overhang' in window['geo']
+
+
+def compile_obstruction(window, config):
+    """Compile the obstruction profile of a window into altitude limits.
+
+    Returns two arrays of RESOLUTION entries with the minimum and maximum
+    sun altitude in radians per azimuth degree, for an O(1) lookup.
+    The window config supports in its 'geo' section:
+      "horizon": list of [azimuth, elevation] points in degrees, linearly
+                 interpolated, or a list of RESOLUTION elevations, one per
+                 degree from azimuth 0; azimuths are relative to AZIMUTH_BASE
+                 as geo.az
+      "overhang": {"depth": d, "height": h}, a horizontal overhang of depth d
+                 at height h above the window sill"""
+    geo = window['geo']
+    azimuth = np.arange(RESOLUTION) * 360 / RESOLUTION
+
+    # lower limit: generic altitude restriction and horizon profile
+    altitude_limit = geo.get('min_altitude', config['CONTROL']['min_altitude'])
+    min_altitude = np.full(RESOLUTION, float(altitude_limit))
+    if 'horizon' in geo:
+        horizon = geo['horizon']
+        if len(horizon) == RESOLUTION and not isinstance(horizon[0], list):
+            # entry i is the elevation at azimuth i degrees
+            points = np.column_stack([np.arange(RESOLUTION) * 360 / RESOLUTION,
+                                      np.array(horizon, dtype=np.float64)])
+        else:
+            points = np.array(sorted(horizon), dtype=np.float64)
+        # both formats use the azimuth convention of the window, like geo.az
+        points[:, 0] += config['AZIMUTH_BASE']
+        elevation = np.interp(azimuth, points[:, 0], points[:, 1], period=360)
+        min_altitude = np.maximum(min_altitude, elevation)
+
+    # upper limit: overhang shades the window above its profile angle
+    max_altitude = np.full(RESOLUTION, 90.0)
+    if 'overhang' in geo:
+        overhang = geo['overhang']
+        window_azimuth = geo['az'] + config['AZIMUTH_BASE']
+        cos_diff = np.cos(np.radians(azimuth - window_azimuth))
+        # tan(profile angle) = tan(altitude) / cos(azimuth difference)
+        cutoff = np.degrees(np.arctan(overhang['height'] / overhang['depth'] * cos_diff))
+        max_altitude = np.where(cos_diff > 0, cutoff, max_altitude)
+
+    return np.radians(min_altitude), np.radians(max_altitude)
+
+
+def get_bin(azimuth):
+    """Get the raster index of an azimuth in radians; scalar or array."""
+    if isinstance(azimuth, np.ndarray):
+        return np.floor(np.degrees(azimuth) * RESOLUTION / 360).astype(np.int64) % RESOLUTION
+    return int(math.floor(math.degrees(azimuth) * RESOLUTION / 360)) % RESOLUTION
@@ -0,0 +1,173 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import logging
+import math
+import datetime
+import numpy as np
+
+# self-defined modules
+from blindctrl.sunpower.powercalc import PowerCalculator
+from blindctrl.sunpower.suntable import get_sun_positions
+from blindctrl.sunpower import obstruction
+
+
+class BatchPowerCalculator(PowerCalculator):
+    """Vectorized variant of PowerCalculator.
+
+    All window normals and range restrictions are compiled into arrays once,
+    so that the power of every window is derived in one numpy pass.
+    """
+
+    def __init__(self, config, windows=None):
+        # call parent constructor
+        super().__init__(config)
+
+        # compiled window data
+        self.windows = None
+        self.normals = None
+        self.altitude_limits = None
+        self.angle_limits = None
+        # (N,RESOLUTION) altitude rasters, None if no window is obstructed
+        self.min_altitudes = None
+        self.max_altitudes = None
+        self.angles = None
+
+        if windows is None:
+            windows = config['WINDOWS']
+        self.compile(windows)
+
+
+    def compile(self, windows):
+        # store windows to detect reconfiguration
+        self.windows = windows
+
+        # window normals as (N,3) array
+        azimuth = np.radians(np.array(
+            [window['geo']['az'] + self.config['AZIMUTH_BASE'] for window in windows],
+            dtype=np.float64))
+        altitude = np.radians(np.array(
+            [window['geo']['alt'] for window in windows], dtype=np.float64))
+        self.normals = self.polar_to_euklid_array(azimuth, altitude)
+
+        # range restrictions, resolved into arrays in radians
+        self.altitude_limits = np.radians(np.array(
+            [window['geo'].get('min_altitude', self.config['CONTROL']['min_altitude'])
+             for window in windows], dtype=np.float64))
+        self.angle_limits = np.radians(np.array(
+            [window['geo'].get('max_angle', self.config['CONTROL']['max_angle'])
+             for window in windows], dtype=np.float64))
+
+        # obstruction rasters, which include the altitude limits
+        if any(obstruction.has_obstruction(window) for window in windows):
+            rasters = [obstruction.compile_obstruction(window, self.config) for window in windows]
+            self.min_altitudes = np.array([raster[0] for raster in rasters])
+            self.max_altitudes = np.array([raster[1] for raster in rasters])
+        else:
+            self.min_altitudes = None
+            self.max_altitudes = None
+
+
+    def get_altitude_limits(self, sun_azimuth):
+        """Get minimum and maximum sun altitude of all windows for the given
+        sun azimuth; shapes (N,) or (T,N)."""
+        if self.min_altitudes is None:
+            return self.altitude_limits, np.full(len(self.altitude_limits), np.pi/2)
+        index = obstruction.get_bin(sun_azimuth)
+        # move window axis last
+        return np.moveaxis(self.min_altitudes[:, index], 0, -1), \
+               np.moveaxis(self.max_altitudes[:, index], 0, -1)
+
+
+    @staticmethod
+    def polar_to_euklid_array(azimuth, altitude):
+        # array version of polar_to_euklid, last axis holds the coordinates
+        cos_altitude = np.cos(altitude)
+        return np.stack((
+            cos_altitude*np.cos(azimuth),
+            cos_altitude*np.sin(azimuth),
+            np.sin(altitude)
+        ), axis=-1)
+
+
+    def get_powers(self, sun_azimuth, sun_altitude):
+        """Derive angles and powers of all windows.
+
+        sun_azimuth and sun_altitude are given in radians, either as scalars
+        or as arrays of shape (T,). The results have shape (N,) or (T,N)."""
+        sun_azimuth = np.asarray(sun_azimuth, dtype=np.float64)
+        sun_altitude = np.asarray(sun_altitude, dtype=np.float64)
+        sun_coordinates = self.polar_to_euklid_array(sun_azimuth, sun_altitude)
+
+        # determine angles, we assume normalized vectors
+        cos_phi = np.clip(sun_coordinates @ self.normals.T, -1.0, 1.0)
+        angles = np.arccos(cos_phi)
+
+        # check for sun: must be visible and window angle OK
+        min_altitudes, max_altitudes = self.get_altitude_limits(sun_azimuth)
+        altitude = sun_altitude[..., np.newaxis]
+        visible = (altitude > min_altitudes) & (altitude < max_altitudes) & \
+                  (angles < self.angle_limits)
+        powers = np.where(visible, np.cos(angles), 0.0)
+
+        return angles, powers
+
+
+    def get_margins(self, sun_azimuth, sun_altitude, threshold):
+        """Derive a continuous switching margin of all windows.
+
+        The margin is positive if and only if the window power reaches
+        threshold, so its roots are the switching times. Shapes as for
+        get_powers."""
+        sun_azimuth = np.asarray(sun_azimuth, dtype=np.float64)
+        sun_altitude = np.asarray(sun_altitude, dtype=np.float64)
+        sun_coordinates = self.polar_to_euklid_array(sun_azimuth, sun_altitude)
+        cos_phi = sun_coordinates @ self.normals.T
+
+        # all conditions of get_powers must be fulfilled
+        min_altitudes, max_altitudes = self.get_altitude_limits(sun_azimuth)
+        sin_altitude = np.sin(sun_altitude)[..., np.newaxis]
+        return np.minimum.reduce((
+            cos_phi - threshold,
+            sin_altitude - np.sin(min_altitudes),
+            np.sin(max_altitudes) - sin_altitude,
+            cos_phi - np.cos(self.angle_limits),
+        ))
+
+
+    def process(self, windows=None):
+        # recompile if a different window set is given
+        if windows is not None and windows is not self.windows:
+            self.compile(windows)
+
+        # get sun position
+        sun = self.get_sun_coordinates()
+
+        # derive all windows at once
+        self.angles, powers = self.get_powers(sun.az, sun.alt)
+        self.power_values[:] = powers.tolist()
+
+        # perform logging
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for window, angle, power in zip(self.windows, self.angles, powers):
+                logging.getLogger().debug("{}: angle: {:0.0f}, power: {:0.2f}".format(
+                    window['name'], angle*180/math.pi, power))
+
+
+    def forecast(self, hours=24, step=60, start=None):
+        """Derive the power of all windows on a time grid.
+
+        Returns the UTC timestamps of shape (T,) and the powers of shape (T,N),
+        computed in one batch over the time x window matrix."""
+        if start is None:
+            start = datetime.datetime.utcnow()
+        start = start.replace(tzinfo=datetime.timezone.utc).timestamp()
+        timestamps = start + step*np.arange(int(hours*3600 // step) + 1, dtype=np.float64)
+
+        # get sun positions for the full grid
+        azimuth, altitude = get_sun_positions(self.latitude, self.longitude,
+                                              timestamps, self.get_sun_table())
+
+        powers = self.get_powers(azimuth, altitude)[1]
+        return timestamps, powers
@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import math
+import random
+import timeit
+
+# self-defined modules
+from blindctrl.sunpower.powercalc import PowerCalculator, SunPosition
+from blindctrl.sunpower.powerbatch import BatchPowerCalculator
+
+
+usage = """\
+Usage: {name} [<nr_windows> [<repetitions>]]
+
+Compares the scalar and the vectorized power calculation on a synthetic set
+of windows. Both results are checked for equality.
+"""
+
+
+CONFIG = {
+    'AZIMUTH_BASE': 0,
+    'CONTROL': {
+        'min_altitude': 1.0,
+        'max_angle': 80,
+    },
+}
+
+
+def create_windows(nr_windows):
+    windows = []
+    for i in range(nr_windows):
+        window = {
+            'name': "Window {}".format(i),
+            'geo': {'alt': random.uniform(0, 60), 'az': random.uniform(0, 360)},
+        }
+        # some windows with individual range restrictions
+        if i % 3 == 0:
+            window['geo']['min_altitude'] = random.uniform(0, 20)
+        if i % 5 == 0:
+            window['geo']['max_angle'] = random.uniform(40, 90)
+        if i % 7 == 0:
+            window['geo']['horizon'] = [[az, random.uniform(0, 40)] for az in range(0, 360, 45)]
+        if i % 11 == 0:
+            window['geo']['overhang'] = {'depth': random.uniform(0.2, 1), 'height': 1.5}
+        windows.append(window)
+    return windows
+
+
+def run_scalar(calculator, sun, windows):
+    sun_coordinates = calculator.polar_to_euklid(sun.az, sun.alt)
+    return [calculator.get_window_power(sun, sun_coordinates, window)[1]
+            for window in windows]
+
+
+def main(nr_windows=5000, repetitions=20):
+    windows = create_windows(nr_windows)
+    scalar = PowerCalculator(CONFIG)
+    batch = BatchPowerCalculator(CONFIG, windows)
+    # use one fixed sun position for both variants
+    sun = SunPosition(math.radians(150), math.radians(30))
+
+    # verify identical results
+    scalar_powers = run_scalar(scalar, sun, windows)
+    batch_powers = batch.get_powers(sun.az, sun.alt)[1]
+    max_diff = max(abs(a-b) for a, b in zip(scalar_powers, batch_powers))
+    print("{} windows, max deviation: {:g}".format(nr_windows, max_diff))
+
+    # measure
+    time_scalar = timeit.timeit(lambda: run_scalar(scalar, sun, windows),
+                                number=repetitions) / repetitions
+    time_batch = timeit.timeit(lambda: batch.get_powers(sun.az, sun.alt),
+                               number=repetitions) / repetitions
+    print("scalar: {:8.3f} ms".format(time_scalar*1000))
+    print("batch:  {:8.3f} ms".format(time_batch*1000))
+    print("speedup: {:0.1f}x".format(time_scalar/time_batch))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 3 and all(arg.isdigit() for arg in sys.argv[1:]):
+        main(*[int(arg) for arg in sys.argv[1:]])
+    else:
+        print(usage.format(name="powerbench"))
@@ -7,20 +7,43 @@ import ephem
 import datetime
 import math
 
+# self-defined modules
+from blindctrl.sunpower.suntable import SunPosition, get_location, load_sun_table
+from blindctrl.sunpower import obstruction
+
 
 class PowerCalculator():
     def __init__(self, config):
         self.config = config
         self.power_values = []
+        # observer location
+        self.latitude, self.longitude = get_location(config)
+        # loaded on first use; False if not available
+        self.sun_table = None
+        # compiled obstruction rasters per window name
+        self.obstructions = {}
 
 
-    @staticmethod
-    def get_sun_coordinates():
-        # get sun position
-        o = ephem.Observer()
-        # Vienna: 48 degree north; 16 degree east
-        o.lat, o.long, o.date = '48:13', '16:22', datetime.datetime.utcnow()
-        sun = ephem.Sun(o)
+    def get_sun_table(self):
+        # load sun table on first use
+        if self.sun_table is None:
+            self.sun_table = load_sun_table(self.config, self.latitude, self.longitude) \
+                             or False
+        return self.sun_table or None
+
+    def get_sun_coordinates(self, date=None):
+        if date is None:
+            date = datetime.datetime.utcnow()
+
+        # use precomputed sun table if available
+        table = self.get_sun_table()
+        if table is not None and table.covers(date):
+            sun = table.lookup(date)
+        else:
+            # get sun position
+            o = ephem.Observer()
+            o.lat, o.long, o.date = self.latitude, self.longitude, date
+            sun = ephem.Sun(o)
         logging.getLogger().debug("sun azimuth: {}; altitude: {}".format(sun.az, sun.alt))
         # transform from polar to euklid coordinates
         return sun
@@ -64,7 +87,8 @@ class PowerCalculator():
             angle_limit = self.config['CONTROL']['max_angle']
         
         # check for sun: must be visible and window angle OK
-        if sun.alt > altitude_limit*math.pi/180 and angle < angle_limit*math.pi/180:
+        if sun.alt > altitude_limit*math.pi/180 and angle < angle_limit*math.pi/180 and \
+                not self.is_obstructed(sun, window):
             power = math.cos(angle)
         else:
             power = 0.0
@@ -72,6 +96,17 @@ class PowerCalculator():
         return angle, power
         
 
+    def is_obstructed(self, sun, window):
+        if not obstruction.has_obstruction(window):
+            return False
+        # compile raster on first use
+        if window['name'] not in self.obstructions:
+            self.obstructions[window['name']] = obstruction.compile_obstruction(window, self.config)
+        min_altitude, max_altitude = self.obstructions[window['name']]
+        index = obstruction.get_bin(sun.az)
+        return not min_altitude[index] < sun.alt < max_altitude[index]
+
+
     def process(self, windows):
         # clear result array, if already filled
         del self.power_values[:]
@@ -5,51 +5,84 @@
 import sys
 import os
 import logging
-import configparser
 import traceback
+import csv
+import datetime
+import math
+import concurrent.futures
+import asyncio
+import numpy as np
 
 # self-defined modules
 from blindctrl.shared.stdscript import StandardScript
-from blindctrl.sunpower.powercalc import PowerCalculator
-from blindctrl.shared.opcclient import OpcClient
-from blindctrl.shared.httpclient import HttpClient
+from blindctrl.shared.sites import get_site_configs
+from blindctrl.shared.statestore import create_state_store
+from blindctrl.shared.history import create_history
+from blindctrl.shared.deadband import create_change_filter
+from blindctrl.shared.mqttsink import get_mqtt_sink
+from blindctrl.sunpower.powerbatch import BatchPowerCalculator
+from blindctrl.shared.clients import get_opc_client, get_async_opc_client
 
 
 usage = """\
 Usage: {name}
+       {name} forecast [<hours> [<step_minutes> [<filename>]]]
+       {name} sites
 
 Derives the power of all windows based on their current angle to the sun. 
 The window data is configured in the configuration file.
+In forecast mode the power of all windows is derived for the next <hours>
+(default 24) in steps of <step_minutes> (default 1). The result is written
+as CSV to <filename> or stdout, or as numpy archive if <filename> ends with
+.npz.
+In sites mode all sites configured in SITES are processed in one invocation,
+distributed over a process pool.
 """
 
 
 class SunPower(StandardScript):
-    def __init__(self):
+    def __init__(self, config=None):
         # call parent constructor
-        super().__init__()
+        super().__init__(config)
 
         # setup OPC interface
         if self.config['OPC_STORAGE']['enabled']:
-            if "type_json" in self.config['OPC_STORAGE'] and self.config['OPC_STORAGE']['type_json']:
-                self.opcclient = HttpClient(self.config['OPC_STORAGE']['url'],
-                                            self.config['OPC_STORAGE']['password'])
-            else:
-                self.opcclient = OpcClient(self.config['OPC_STORAGE']['url'],
-                                           self.config['OPC_STORAGE']['password'])
+            self.opcclient = get_opc_client(self.config)
+            self.async_opcclient = get_async_opc_client(self.config)
+
+        # setup data file storage
+        if self.config['FILE_STORAGE']['enabled']:
+            self.state_store = create_state_store(self.config)
+
+        # setup mqtt connection
+        if self.config['MQTT_STORAGE']['enabled']:
+            self.mqtt = get_mqtt_sink(self.config)
+
+        # setup change detection of outputs
+        self.change_filter = create_change_filter(self.config, 'sunpower')
+
+        # setup history
+        self.history = create_history(self.config)
 
         # setup power calculator
-        self.calculator = PowerCalculator(self.config)
+        self.calculator = BatchPowerCalculator(self.config)
 
-    def process(self):
+    def process(self, store_file=True):
         try:
             # process effective angles
             self.calculator.process(self.config['WINDOWS'])
 
             # store power values
+            # file storage may be left to a hosting pipeline
             if self.config['OPC_STORAGE']['enabled']:
                 self.save_opc()
-            if self.config['FILE_STORAGE']['enabled']:
+            if self.config['FILE_STORAGE']['enabled'] and store_file:
                 self.save_file()
+            if self.config['MQTT_STORAGE']['enabled']:
+                self.save_mqtt()
+            if self.history is not None:
+                self.history.append('sunpower', [window['name'] for window in self.config['WINDOWS']],
+                                    self.calculator.power_values)
 
         except Exception as e:
             logging.getLogger().error(traceback.format_exc())
@@ -57,8 +90,52 @@ class SunPower(StandardScript):
 
         return self.calculator.power_values
 
-    def save_opc(self):
-        # store OPC requests
+    def process_sites(self):
+        site_configs = get_site_configs(self.config)
+        workers = self.config.get('SITE_WORKERS') or os.cpu_count() or 1
+        workers = min(workers, len(site_configs))
+        # shard sites evenly across the worker processes
+        chunksize = max(1, math.ceil(len(site_configs) / (4*workers)))
+
+        results = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for site_config, power_values in zip(
+                    site_configs, executor.map(process_site, site_configs, chunksize=chunksize)):
+                results[site_config.get('name', "")] = power_values
+        logging.getLogger().info("Processed {} sites".format(len(results)))
+        return results
+
+    def forecast(self, hours=24, step_minutes=1, filename=None):
+        try:
+            timestamps, powers = self.calculator.forecast(hours, step_minutes*60)
+            names = [window['name'] for window in self.config['WINDOWS']]
+
+            if filename is not None and filename.endswith('.npz'):
+                np.savez(filename, timestamps=timestamps, powers=powers.astype(np.float32),
+                         names=np.array(names))
+            elif filename is not None:
+                with open(filename, 'w', newline='') as csv_file:
+                    self._write_forecast_csv(csv_file, names, timestamps, powers)
+            else:
+                self._write_forecast_csv(sys.stdout, names, timestamps, powers)
+
+        except Exception as e:
+            logging.getLogger().error(traceback.format_exc())
+            raise
+
+        return timestamps, powers
+
+    @staticmethod
+    def _write_forecast_csv(csv_file, names, timestamps, powers):
+        writer = csv.writer(csv_file)
+        writer.writerow(['time'] + names)
+        for timestamp, row in zip(timestamps, powers):
+            date = datetime.datetime.utcfromtimestamp(timestamp)
+            writer.writerow([date.strftime("%Y-%m-%dT%H:%M:%SZ")] +
+                            ["{:0.3f}".format(power) for power in row])
+
+    def get_opc_items(self):
+        """Get keys, tags, values and types of the changed OPC items."""
         opc_tags = []
         types = []
         values = []
@@ -70,28 +147,91 @@ class SunPower(StandardScript):
                 types.append('float')
                 values.append(self.calculator.power_values[i])
 
+        # skip unchanged values
+        return self.change_filter.select_changed('opc:', opc_tags, values, types)
+
+    def save_opc(self):
+        # store OPC requests
+        keys, opc_tags, values, types = self.get_opc_items()
+
         # write data to OPC
         if len(opc_tags) > 0:
             self.opcclient.write(opc_tags, types, values)
+            self.change_filter.commit(keys, values)
 
-    def save_file(self):
-        config = configparser.ConfigParser()
-        # read existing file data
-        if os.path.isfile(self.config['FILE_STORAGE']['filename']):
-            try:
-                config.read(self.config['FILE_STORAGE']['filename'])
-            except configparser.ParsingError as e:
-                logging.getLogger().error("Error parsing file storage: " + str(e))
+    async def save_opc_async(self):
+        keys, opc_tags, values, types = self.get_opc_items()
+        if len(opc_tags) > 0:
+            values_ok = await self.async_opcclient.write(opc_tags, types, values)
+            # only record accepted values, the others are retried next cycle
+            self.change_filter.commit([key for key, ok in zip(keys, values_ok) if ok],
+                                      [value for value, ok in zip(values, values_ok) if ok])
+
+    async def save_file_async(self):
+        values = self.get_file_values()
+        keys = ['file:sunpower/' + name for name in values]
+        loop = asyncio.get_running_loop()
+        if self.change_filter.any_changed(keys, values.values()) or \
+                not await loop.run_in_executor(None, self.state_store.read_section, 'sunpower'):
+            await loop.run_in_executor(None, self.state_store.write_section, 'sunpower', values)
+            self.change_filter.commit(keys, list(values.values()))
+
+    async def process_async(self, store_file=True):
+        """process as coroutine, writing to all sinks in parallel"""
+        try:
+            self.calculator.process(self.config['WINDOWS'])
+
+            loop = asyncio.get_running_loop()
+            sinks = []
+            if self.config['OPC_STORAGE']['enabled']:
+                sinks.append(self.save_opc_async())
+            if self.config['FILE_STORAGE']['enabled'] and store_file:
+                sinks.append(self.save_file_async())
+            if self.config['MQTT_STORAGE']['enabled']:
+                sinks.append(loop.run_in_executor(None, self.save_mqtt))
+            if self.history is not None:
+                sinks.append(loop.run_in_executor(
+                    None, self.history.append, 'sunpower',
+                    [window['name'] for window in self.config['WINDOWS']],
+                    self.calculator.power_values))
+            await asyncio.gather(*sinks)
 
+        except Exception as e:
+            logging.getLogger().error(traceback.format_exc())
+            raise
+
+        return self.calculator.power_values
+
+    def save_mqtt(self):
+        # publish changed power values
+        keys, topics, values = self.change_filter.select_changed(
+            'mqtt:' + self.mqtt.prefix, self.mqtt.window_topics(self.config['WINDOWS'], 'power'),
+            ["{:0.3f}".format(power) for power in self.calculator.power_values])
+        for topic, value in zip(topics, values):
+            self.mqtt.publish(topic, value)
+        if len(topics) and self.mqtt.flush():
+            self.change_filter.commit(keys, values)
+
+    def get_file_values(self):
         # recreate data of this script
-        config['sunpower'] = {}
+        values = {}
         for i in range(len(self.config['WINDOWS'])):
-            config['sunpower'][self.config['WINDOWS'][i]['name']] = \
-                str(self.calculator.power_values[i])
+            values[self.config['WINDOWS'][i]['name']] = str(self.calculator.power_values[i])
+        return values
+
+    def save_file(self):
+        values = self.get_file_values()
+        keys = ['file:sunpower/' + name for name in values]
+        # save data file, if anything changed or it got lost, e.g. in /tmp on reboot
+        if self.change_filter.any_changed(keys, values.values()) or \
+                not self.state_store.read_section('sunpower'):
+            self.state_store.write_section('sunpower', values)
+            self.change_filter.commit(keys, list(values.values()))
+
 
-        # save data file
-        with open(self.config['FILE_STORAGE']['filename'], 'w') as configfile:
-            config.write(configfile)
+def process_site(site_config):
+    """derive and store the window powers of a single site, in a worker process"""
+    return SunPower(site_config).process()
 
 
 if __name__ == "__main__":
@@ -101,5 +241,13 @@ if __name__ == "__main__":
     if len(sys.argv) == 1:
         # derive all window power values
         sunpower.process()
+    elif sys.argv[1:] == ['sites']:
+        # derive window power values of all sites
+        sunpower.process_sites()
+    elif sys.argv[1] == 'forecast' and len(sys.argv) <= 5:
+        # derive power time series of all windows
+        sunpower.forecast(float(sys.argv[2]) if len(sys.argv) > 2 else 24,
+                          float(sys.argv[3]) if len(sys.argv) > 3 else 1,
+                          sys.argv[4] if len(sys.argv) > 4 else None)
     else:
         print(usage.format(name=sunpower.scriptname))
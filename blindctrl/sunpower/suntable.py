@@ -0,0 +1,266 @@
+#! /usr/bin/env python3
+# -*- coding: iso-8859-15 -*-
+
+# standard modules
+import sys
+import json
+import math
+import random
+import logging
+import datetime
+import collections
+import ephem
+import numpy as np
+
+# self-defined modules
+from blindctrl.shared.stdscript import StandardScript
+
+
+usage = """\
+Usage: {name} build <filename> [<days> [<step_seconds>]]
+       {name} verify <filename> [<samples>]
+
+Precomputes the sun position (azimuth, altitude) for the configured site
+starting today and stores it to <filename>. "verify" compares random samples
+of an existing table against ephem.
+"""
+
+
+# sun position in radians
+SunPosition = collections.namedtuple('SunPosition', ['az', 'alt'])
+
+
+class SunTable():
+    """Precomputed sun positions on an equidistant time grid.
+
+    The positions are stored as float32 radians in a .npy file, which is
+    memory mapped on load. The grid parameters are kept in a JSON sidecar
+    file. A lookup is an O(1) index plus linear interpolation."""
+
+    # default location if not configured
+    # Vienna: 48 degree north; 16 degree east
+    LATITUDE, LONGITUDE = '48:13', '16:22'
+
+    # sun semidiameter in degrees, used to estimate upper limb crossings
+    SUN_RADIUS = 0.267
+
+    def __init__(self, latitude, longitude, start, step, data):
+        self.latitude = latitude
+        self.longitude = longitude
+        # start time as UTC timestamp and grid step in seconds
+        self.start = start
+        self.step = step
+        # (T,2) array of azimuth and altitude
+        self.data = data
+
+
+    @staticmethod
+    def _timestamp(date):
+        # naive datetimes are assumed to be UTC, as returned by utcnow()
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return date.timestamp()
+
+
+    @classmethod
+    def build(cls, latitude, longitude, start, days=1, step=60):
+        # align to full grid steps
+        start = math.floor(cls._timestamp(start) / step) * step
+        count = int(days*86400 // step) + 1
+        timestamps = start + step*np.arange(count, dtype=np.float64)
+        data = np.empty((count, 2), dtype=np.float32)
+        data[:, 0], data[:, 1] = get_sun_positions(latitude, longitude, timestamps)
+
+        logging.getLogger().info("Built sun table with {} entries".format(count))
+        return cls(latitude, longitude, start, step, data)
+
+
+    def save(self, filename):
+        # np.save would append .npy to the name, but load opens it as given
+        with open(filename, 'wb') as data_file:
+            np.save(data_file, self.data)
+        with open(filename + ".json", 'w') as header_file:
+            json.dump({
+                'latitude': self.latitude,
+                'longitude': self.longitude,
+                'start': self.start,
+                'step': self.step,
+                'count': len(self.data),
+            }, header_file)
+
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename + ".json") as header_file:
+            header = json.load(header_file)
+        data = np.load(filename, mmap_mode='r')
+        if len(data) != header['count']:
+            raise ValueError("Sun table {} is inconsistent".format(filename))
+        return cls(header['latitude'], header['longitude'],
+                   header['start'], header['step'], data)
+
+
+    def matches(self, latitude, longitude):
+        return self.latitude == latitude and self.longitude == longitude
+
+
+    def covers(self, date):
+        position = (self._timestamp(date) - self.start) / self.step
+        return 0 <= position <= len(self.data) - 1
+
+
+    def lookup(self, date):
+        """Get the sun position at date or None if the table does not cover it."""
+        position = (self._timestamp(date) - self.start) / self.step
+        if not 0 <= position <= len(self.data) - 1:
+            return None
+        index = min(int(position), len(self.data) - 2)
+        fraction = position - index
+        az0, alt0 = self.data[index]
+        az1, alt1 = self.data[index+1]
+
+        # interpolate azimuth along the shorter arc
+        az_diff = (float(az1) - float(az0) + math.pi) % (2*math.pi) - math.pi
+        azimuth = (float(az0) + fraction*az_diff) % (2*math.pi)
+        altitude = float(alt0) + fraction*(float(alt1) - float(alt0))
+        return SunPosition(azimuth, altitude)
+
+
+    def lookup_array(self, timestamps):
+        """Vectorized lookup for UTC timestamps; returns azimuth and altitude arrays."""
+        position = (np.asarray(timestamps, dtype=np.float64) - self.start) / self.step
+        if np.any(position < 0) or np.any(position > len(self.data) - 1):
+            raise ValueError("Time range not covered by sun table")
+        index = np.minimum(position.astype(np.int64), len(self.data) - 2)
+        fraction = position - index
+        az0 = self.data[index, 0].astype(np.float64)
+        az1 = self.data[index+1, 0].astype(np.float64)
+        alt0 = self.data[index, 1].astype(np.float64)
+        alt1 = self.data[index+1, 1].astype(np.float64)
+
+        az_diff = (az1 - az0 + np.pi) % (2*np.pi) - np.pi
+        azimuth = (az0 + fraction*az_diff) % (2*np.pi)
+        altitude = alt0 + fraction*(alt1 - alt0)
+        return azimuth, altitude
+
+
+    def next_setting(self, date, horizon):
+        """Get the next time after date the upper limb of the sun sets below
+        horizon (in degrees), as naive UTC datetime; None if not covered."""
+        position = (self._timestamp(date) - self.start) / self.step
+        first = max(int(math.ceil(position)), 1)
+        # the sun sets within the next two days, except in polar regions
+        last = min(first + int(2*86400 // self.step), len(self.data))
+        if first >= last:
+            return None
+
+        limit = math.radians(horizon - self.SUN_RADIUS)
+        altitude = np.asarray(self.data[first-1:last, 1], dtype=np.float64)
+        crossings = np.nonzero((altitude[:-1] >= limit) & (altitude[1:] < limit))[0]
+        if len(crossings) == 0:
+            return None
+
+        # interpolate crossing time
+        i = crossings[0]
+        fraction = (altitude[i] - limit) / (altitude[i] - altitude[i+1])
+        timestamp = self.start + (first - 1 + i + fraction) * self.step
+        return datetime.datetime.utcfromtimestamp(timestamp)
+
+
+    def verify(self, samples=1000):
+        """Compare random samples against ephem; returns max error in degrees."""
+        o = ephem.Observer()
+        o.lat, o.long = self.latitude, self.longitude
+        sun = ephem.Sun()
+        max_error = 0.0
+        for _ in range(samples):
+            timestamp = random.uniform(self.start, self.start + (len(self.data)-1)*self.step)
+            date = datetime.datetime.utcfromtimestamp(timestamp)
+            o.date = date
+            sun.compute(o)
+            position = self.lookup(date)
+            az_error = abs((position.az - sun.az + math.pi) % (2*math.pi) - math.pi)
+            # azimuth deviation scales with the altitude
+            az_error *= math.cos(sun.alt)
+            alt_error = abs(position.alt - sun.alt)
+            max_error = max(max_error, math.degrees(max(az_error, alt_error)))
+        return max_error
+
+
+def get_location(config):
+    """Get latitude and longitude of the configured site as ephem strings."""
+    location = config.get('LOCATION', {})
+    return (str(location.get('lat', SunTable.LATITUDE)),
+            str(location.get('long', SunTable.LONGITUDE)))
+
+
+def get_sun_positions(latitude, longitude, timestamps, table=None):
+    """Get azimuth and altitude arrays for an array of UTC timestamps.
+
+    The sun table is used if it covers the full range, else ephem."""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if table is not None and table.matches(latitude, longitude) and len(timestamps) and \
+            table.start <= timestamps.min() and \
+            timestamps.max() <= table.start + (len(table.data)-1)*table.step:
+        return table.lookup_array(timestamps)
+
+    # reuse observer and body for all points
+    o = ephem.Observer()
+    o.lat, o.long = latitude, longitude
+    sun = ephem.Sun()
+    epoch = ephem.Date(datetime.datetime(1970, 1, 1))
+    azimuth = np.empty(len(timestamps))
+    altitude = np.empty(len(timestamps))
+    for i, timestamp in enumerate(timestamps):
+        o.date = epoch + timestamp / 86400
+        sun.compute(o)
+        azimuth[i] = sun.az
+        altitude[i] = sun.alt
+    return azimuth, altitude
+
+
+def load_sun_table(config, latitude, longitude, date=None):
+    """Load the configured sun table if it is valid for location and date.
+
+    Returns None if the table is disabled, missing or stale."""
+    table_config = config.get('SUN_TABLE')
+    if not table_config or not table_config['enabled']:
+        return None
+    if date is None:
+        date = datetime.datetime.utcnow()
+
+    try:
+        table = SunTable.load(table_config['filename'])
+    except (OSError, ValueError) as e:
+        logging.getLogger().warning("Sun table not available: " + str(e))
+        return None
+    if not table.matches(latitude, longitude) or not table.covers(date):
+        logging.getLogger().warning("Sun table is stale, using ephem")
+        return None
+    return table
+
+
+def main(args):
+    # read site and table settings
+    script = StandardScript()
+    table_config = script.config.get('SUN_TABLE', {})
+    latitude, longitude = get_location(script.config)
+    filename = args[1]
+
+    if args[0] == 'build':
+        days = float(args[2]) if len(args) > 2 else table_config.get('days', 366)
+        step = int(args[3]) if len(args) > 3 else table_config.get('step', 60)
+        start = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        table = SunTable.build(latitude, longitude, start, days, step)
+        table.save(filename)
+    else:
+        samples = int(args[2]) if len(args) > 2 else 1000
+        table = SunTable.load(filename)
+        print("max deviation: {:0.4f} degrees".format(table.verify(samples)))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] in ('build', 'verify'):
+        main(sys.argv[1:])
+    else:
+        print(usage.format(name="suntable"))
@@ -3,46 +3,172 @@
 
 import logging
 import csv
+import io
+import os
+import calendar
+import warnings
 import datetime
+import numpy as np
 
 
 class CsvDecoder():
+    """Decoder of the ZAMG forecast CSV rows <YYYYMMDD>;<hour>;<temperature>;<sun>.
+
+    The rows are stored as columns: UTC timestamps in seconds, temperature
+    and sun minutes, sorted by time."""
+
     def __init__(self, config):
         self.config = config
-        self.data = None
+        self.timestamps = np.zeros(0)
+        self.temperature = np.zeros(0)
+        self.sun = np.zeros(0, dtype=np.int32)
+        # UTC timestamp of midnight per date string
+        self._days = {}
+
+
+    def _parse_day(self, day):
+        timestamp = self._days.get(day)
+        if timestamp is None:
+            timestamp = calendar.timegm(datetime.datetime.strptime(day, "%Y%m%d").timetuple())
+            self._days[day] = timestamp
+        return timestamp
 
 
-    def __parseInt(self, string):
-        if len(string) > 0:
-            return int(string)
+    def rows(self, lines):
+        """Yield timestamp, temperature and sun minutes of all data rows of
+        the iterable lines."""
+        for row in csv.reader(lines, delimiter=";"):
+            # skip headers and incomplete rows
+            if len(row) == 4 and row[0].isdigit():
+                yield (self._parse_day(row[0]) + 3600*int(row[1]), float(row[2]), int(row[3]))
+
+
+    def decode_lines(self, lines):
+        # keep data rows only, skipping headers and incomplete rows
+        lines = [line for line in lines if line.count(';') == 3 and line.lstrip('"')[:1].isdigit()]
+        # all fields are numeric, so parse them at once
+        try:
+            with warnings.catch_warnings():
+                # numpy warns about unparsable data, future versions raise
+                warnings.simplefilter('error', DeprecationWarning)
+                values = np.fromstring(";".join(lines), sep=';') if lines else np.zeros(0)
+        except (ValueError, DeprecationWarning):
+            values = None
+        if values is not None and len(values) == 4*len(lines):
+            values = values.reshape(-1, 4)
+            # parse each date only once
+            unique_days, day_index = np.unique(values[:, 0].astype(np.int64), return_inverse=True)
+            midnights = np.array([self._parse_day(str(day)) for day in unique_days], dtype=np.float64)
+            self.timestamps = midnights[day_index] + 3600*values[:, 1]
+            self.temperature = values[:, 2].copy()
+            self.sun = values[:, 3].astype(np.int32)
         else:
-            return None
+            # quoted or malformed fields, convert row by row
+            rows = list(self.rows(lines))
+            self.timestamps = np.array([row[0] for row in rows], dtype=np.float64)
+            self.temperature = np.array([row[1] for row in rows], dtype=np.float64)
+            self.sun = np.array([row[2] for row in rows], dtype=np.int32)
+        # lookups bisect the timestamps
+        if np.any(np.diff(self.timestamps) < 0):
+            order = np.argsort(self.timestamps, kind='stable')
+            self.timestamps = self.timestamps[order]
+            self.temperature = self.temperature[order]
+            self.sun = self.sun[order]
 
+        logging.getLogger().info("decoded data (" +
+                            str(len(self.timestamps)) + " lines)")
 
-    def __extractRowData(self, row):
-        # convert data types
-        data = {}
-        data['date'] = datetime.datetime.strptime(row[0], "%Y%m%d") + \
-                       datetime.timedelta(hours=int(row[1]))
-        data['temperature'] = float(row[2])
-        data['sun'] = int(row[3])
-        return data
+        return len(self.timestamps)
 
 
     def decode(self, csv_string):
-        lines = csv_string.split('\r\n')
-        count = 0
-        self.data = []
-
-        # decode file
-        reader = csv.reader(lines, delimiter=";")
-        for row in reader:
-            # add row
-            if len(row) == 4:
-                self.data.append(self.__extractRowData(row))
-                count += 1
+        return self.decode_lines(csv_string.split('\r\n'))
 
-        logging.getLogger().info("decoded data (" +
-                            str(len(self.data)) + " lines)")
 
-        return count
+    def decode_stream(self, stream, encoding='iso-8859-15'):
+        """Decode a text or binary file object line by line."""
+        if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(stream, 'mode', ''):
+            stream = io.TextIOWrapper(stream, encoding=encoding)
+        return self.decode_lines(line.rstrip('\r\n') for line in stream)
+
+
+    def get_row(self, index):
+        return {
+            'date': datetime.datetime.utcfromtimestamp(self.timestamps[index]),
+            'temperature': float(self.temperature[index]),
+            'sun': int(self.sun[index]),
+        }
+
+
+    @property
+    def data(self):
+        """All rows as list of dicts of date, temperature and sun."""
+        return [self.get_row(i) for i in range(len(self.timestamps))]
+
+
+    def get_current(self, now=None):
+        """Get the first row not before now (naive UTC), None if there is none."""
+        if now is None:
+            now = datetime.datetime.utcnow()
+        index = np.searchsorted(self.timestamps, calendar.timegm(now.timetuple()) + now.microsecond/1e6)
+        if index == len(self.timestamps):
+            return None
+        return self.get_row(index)
+
+
+    def get_sun_today(self, now=None):
+        """Get the sum of sun minutes from now (naive UTC) until midnight.
+
+        Rows hold the sun minutes of the hour they start, so the hour in
+        progress counts pro rata."""
+        if now is None:
+            now = datetime.datetime.utcnow()
+        timestamp = calendar.timegm(now.timetuple()) + now.microsecond/1e6
+        midnight = calendar.timegm(now.date().timetuple()) + 86400
+        start, end = np.searchsorted(self.timestamps, [timestamp, midnight])
+        total = float(self.sun[start:end].sum())
+        # remainder of the hour in progress
+        if start > 0 and self.timestamps[start-1] < timestamp < self.timestamps[start-1] + 3600:
+            total += self.sun[start-1] * (self.timestamps[start-1] + 3600 - timestamp) / 3600
+        return int(round(total))
+
+
+    def save(self, filename):
+        """Store the decoded series as compact numpy archive, replaced atomically."""
+        with open(filename + ".tmp", 'wb') as cache_file:
+            np.savez(cache_file, timestamps=self.timestamps,
+                     temperature=self.temperature.astype(np.float32), sun=self.sun.astype(np.int16))
+        os.replace(filename + ".tmp", filename)
+
+
+    def load(self, filename):
+        with np.load(filename) as cache:
+            self.timestamps = cache['timestamps']
+            self.temperature = cache['temperature'].astype(np.float64)
+            self.sun = cache['sun'].astype(np.int32)
+        return len(self.timestamps)
+
+
+    def get_forecast(self, now=None):
+        """Get the row of now (naive UTC) interpolated between the hourly
+        rows, the first row if the series starts later, None after its end."""
+        row = self.interpolate(now)
+        if row is None:
+            row = self.get_current(now)
+        return row
+
+
+    def interpolate(self, now=None):
+        """Get a row of temperature and sun minutes linearly interpolated to
+        now (naive UTC), None if now is not within the series."""
+        if now is None:
+            now = datetime.datetime.utcnow()
+        now = now.replace(second=0, microsecond=0)
+        timestamp = calendar.timegm(now.timetuple())
+        if len(self.timestamps) == 0 or not self.timestamps[0] <= timestamp <= self.timestamps[-1]:
+            return None
+        return {
+            'date': now,
+            'temperature': float(np.interp(timestamp, self.timestamps, self.temperature)),
+            'sun': float(np.interp(timestamp, self.timestamps, self.sun)),
+        }
@@ -1,47 +1,108 @@
 #! /usr/bin/env python
 # -*- coding: iso-8859-15 -*-
 
+import os
 import logging
+import time
+import traceback
 from imapclient import IMAPClient
 import email
 import base64
 import quopri
-import re
-import io
+import email.header
+import concurrent.futures
 
+from blindctrl.shared.statestore import create_state_store
+from blindctrl.zamg.csvdecoder import CsvDecoder
 
 
 class MailParser():
+    # IMAP IDLE timing of watch
+    IDLE_CHECK = 5          # seconds
+    IDLE_RENEW = 25 * 60    # seconds
+    # reconnection backoff of watch
+    RECONNECT_MIN = 5       # seconds
+    RECONNECT_MAX = 600     # seconds
+    # messages per FETCH command
+    FETCH_BATCH = 50
+
     def __init__(self, config):
         self.config = config
         self._paraobservers = []
         self._csvobservers = []
+        self._decoderobservers = []
+        # attachments are only written to disk if an archive is configured
+        self.archive_dir = self.config['EMAIL'].get('archive_dir')
+        if self.archive_dir:
+            os.makedirs(self.archive_dir, exist_ok=True)
+        self.workers = self.config['EMAIL'].get('workers') or 4
+        # fetch only messages newer than the last processed UID
+        # the UID is tracked in the data file, so this needs file storage
+        self.incremental = bool(self.config['EMAIL'].get('incremental', 1))
+        if self.incremental and not self.config['FILE_STORAGE']['enabled']:
+            logging.getLogger().info("File storage disabled, fetching all messages")
+            self.incremental = False
+        if self.incremental:
+            self.state_store = create_state_store(config)
 
 
     def add_csvobserver(self, observer):
         self._csvobservers.append(observer)
 
+    def add_decoderobserver(self, observer):
+        """Notify observer with the CsvDecoder of each attachment, decoded
+        on the thread pool."""
+        self._decoderobservers.append(observer)
+
     def add_paraobserver(self, observer):
         self._paraobservers.append(observer)
 
 
-    def parse(self):
+    def connect(self):
         use_ssl = True if self.config['EMAIL']['useSSL'] else False
         server = IMAPClient(self.config['EMAIL']['servername'], ssl=use_ssl)
         server.login(self.config['EMAIL']['username'], self.config['EMAIL']['password'])
         logging.getLogger().debug("connected to IMAP server")
 
         select_info = server.select_folder('INBOX')
-        # get list of fitting messages
-        messages = server.search(['NOT', 'DELETED', 'SUBJECT', self.config['EMAIL']['subject']])
-        logging.getLogger().info("%d email message(s) found" % len(messages))
+        self.uidvalidity = select_info[b'UIDVALIDITY']
+        return server
 
-        # loop through all messages
-        for msgid in messages:
-            # download it
-            response = server.fetch(msgid, ['RFC822'])
-            msg = email.message_from_bytes(response[msgid][b'RFC822'])
-            self.__process_message(msg)
+
+    def parse(self):
+        server = self.connect()
+        self.process(server)
+        server.logout()
+
+
+    def process(self, server, reprocess_last=True):
+        """Process the messages of the selected folder and get the ones new
+        to the incremental mode, or all."""
+        if self.incremental:
+            messages = self.__parse_incremental(server, self.uidvalidity, reprocess_last)
+        else:
+            # get list of fitting messages
+            messages = server.search(['NOT', 'DELETED', 'SUBJECT', self.config['EMAIL']['subject']])
+            logging.getLogger().info("%d email message(s) found" % len(messages))
+
+            # download in batches, decode on the thread pool meanwhile
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = []
+                for start in range(0, len(messages), self.FETCH_BATCH):
+                    batch = messages[start:start + self.FETCH_BATCH]
+                    response = server.fetch(batch, ['RFC822'])
+                    results += [(msgid, executor.submit(self.decode_message, response[msgid][b'RFC822']))
+                            for msgid in batch if msgid in response]
+                for msgid, future in results:
+                    try:
+                        attachments = future.result()
+                    except Exception:
+                        # keep the other messages decoded in parallel
+                        logging.getLogger().error("Skipping message {}: {}".format(
+                            msgid, traceback.format_exc()))
+                        continue
+                    for csv, decoder, filename in attachments:
+                        self.__notify(csv, decoder, filename)
 
         # delete messages?
         if len(messages) > 0 and int(self.config['EMAIL']['deleteAfterProcessing']):
@@ -51,38 +112,241 @@ class MailParser():
             if self.config['EMAIL']['expungeMailbox']:
                 server.expunge()
             logging.getLogger().info("Deleted email message(s) from server")
+        return messages
 
-        server.logout()
+
+    def watch(self, callback, stopped):
+        """Hold an IMAP IDLE session and call callback after processing new
+        messages, until stopped() is true.
+
+        The last message is processed again every EMAIL.idle_refresh seconds,
+        so that callback gets the current data row. Lost connections are
+        reestablished with exponential backoff."""
+        refresh = self.config['EMAIL'].get('idle_refresh', 900)
+        delay = self.RECONNECT_MIN
+        while not stopped():
+            server = None
+            try:
+                server = self.connect()
+                delay = self.RECONNECT_MIN
+                # catch up on messages received while disconnected
+                self.process(server)
+                callback()
+
+                while not stopped():
+                    server.idle()
+                    logging.getLogger().debug("IMAP idle started")
+                    # IDLE has to be renewed within 29 minutes
+                    renew = time.monotonic() + min(refresh, self.IDLE_RENEW)
+                    announced = False
+                    while not stopped() and not announced and time.monotonic() < renew:
+                        responses = server.idle_check(timeout=self.IDLE_CHECK)
+                        announced = any(len(response) > 1 and response[1] == b'EXISTS'
+                                        for response in responses)
+                    server.idle_done()
+
+                    if announced:
+                        if len(self.process(server, reprocess_last=False)):
+                            callback()
+                    elif not stopped():
+                        self.process(server)
+                        callback()
+
+                server.logout()
+
+            except Exception:
+                logging.getLogger().error(traceback.format_exc())
+                if server is not None:
+                    try:
+                        server.shutdown()
+                    except Exception:
+                        pass
+                # wait for reconnection, but stop in time
+                logging.getLogger().info("Reconnecting to IMAP server in {} s".format(delay))
+                end = time.monotonic() + delay
+                while not stopped() and time.monotonic() < end:
+                    time.sleep(min(1, end - time.monotonic()))
+                delay = min(2 * delay, self.RECONNECT_MAX)
+
+
+    def __parse_incremental(self, server, uidvalidity, reprocess_last=True):
+        # UIDs are only valid within the same UIDVALIDITY of the mailbox
+        stored_validity, last_uid = self.state_store.read_values('imap', ['uidvalidity', 'last_uid'])
+        if stored_validity is None or int(stored_validity) != uidvalidity:
+            last_uid = 0
+        last_uid = int(last_uid or 0)
+
+        criteria = ['NOT', 'DELETED', 'SUBJECT', self.config['EMAIL']['subject']]
+        if last_uid:
+            criteria += ['UID', '{}:*'.format(last_uid + 1)]
+        # n:* always matches the highest UID, even if below n
+        messages = sorted(msgid for msgid in server.search(criteria) if msgid > last_uid)
+        logging.getLogger().info("%d new email message(s) found" % len(messages))
+
+        # without new mail process the last one again for the current data row
+        process = messages if messages or not last_uid or not reprocess_last else [last_uid]
+        if process:
+            response = server.fetch(process, ['ENVELOPE', 'BODYSTRUCTURE'])
+            parts = {}
+            for msgid in process:
+                if msgid in response:
+                    message_parts = self.__get_message_parts(response[msgid])
+                    if message_parts:
+                        parts[msgid] = message_parts
+            self.__process_parts(server, parts)
+
+        if messages:
+            self.state_store.write_section('imap', {
+                'uidvalidity': str(uidvalidity),
+                'last_uid': str(messages[-1]),
+            })
+        return messages
 
 
-    def __process_message(self, msg):
+    def __get_message_parts(self, data):
+        # some more integrity checks
+        envelope = data[b'ENVELOPE']
+        subject = email.header.make_header(email.header.decode_header(
+            (envelope.subject or b'').decode(errors='replace')))
+        if str(subject) != self.config['EMAIL']['subject']:
+            logging.getLogger().error("invalid message detected")
+            return None
+        logging.getLogger().info("processing email message from " + str(envelope.date))
+
+        parts = self.get_csv_parts(data[b'BODYSTRUCTURE'])
+        if not parts:
+            logging.getLogger().error("no csv attachment found")
+        return parts
+
+
+    def __process_parts(self, server, parts):
+        """Download the csv parts, given per message as lists of part number,
+        encoding, charset and filename, and decode them on the thread pool
+        while the next batches are fetched."""
+        # messages with the same part numbers are fetched together
+        groups = {}
+        for msgid in sorted(parts):
+            groups.setdefault(tuple(part[0] for part in parts[msgid]), []).append(msgid)
+
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for numbers, msgids in groups.items():
+                items = ['BODY.PEEK[{}]'.format(number) for number in numbers]
+                keys = [b'BODY[' + number.encode() + b']' for number in numbers]
+                for start in range(0, len(msgids), self.FETCH_BATCH):
+                    batch = msgids[start:start + self.FETCH_BATCH]
+                    response = server.fetch(batch, items)
+                    for msgid in batch:
+                        results[msgid] = [
+                            executor.submit(self.decode_part, response[msgid][key], encoding, charset,
+                                            len(self._decoderobservers) > 0)
+                            for key, (number, encoding, charset, filename) in zip(keys, parts[msgid])]
+
+            # notify in order of arrival, the latest data wins
+            for msgid in sorted(results):
+                try:
+                    attachments = [future.result() for future in results[msgid]]
+                except Exception:
+                    # skip the message, it would fail again on every run
+                    logging.getLogger().error("Skipping message {}: {}".format(
+                        msgid, traceback.format_exc()))
+                    continue
+                for attachment, (number, encoding, charset, filename) in zip(attachments, parts[msgid]):
+                    self.__notify(*attachment, filename)
+
+
+    def decode_part(self, payload, encoding, charset, decode_csv=False):
+        """Get the text of an attachment payload and, if decode_csv is set,
+        its decoded CsvDecoder."""
+        if encoding == 'base64':
+            payload = base64.b64decode(payload)
+        elif encoding == 'quoted-printable':
+            payload = quopri.decodestring(payload)
+        csv = self.decode_text(payload, charset)
+        decoder = None
+        if decode_csv:
+            decoder = CsvDecoder(self.config)
+            decoder.decode(csv)
+        return csv, decoder
+
+
+    @staticmethod
+    def decode_text(payload, charset):
+        try:
+            return payload.decode(charset, errors='replace')
+        except LookupError:
+            # unknown charset, the forecasts are utf-8 or latin
+            logging.getLogger().warning("Unknown charset {}".format(charset))
+            try:
+                return payload.decode('utf-8')
+            except UnicodeDecodeError:
+                return payload.decode('iso-8859-15')
+
+
+    @classmethod
+    def get_csv_parts(cls, structure, prefix=''):
+        """Get part number, transfer encoding, charset and filename of all
+        csv attachments within the IMAP BODYSTRUCTURE."""
+        parts = []
+        if structure.is_multipart:
+            for i, sub_structure in enumerate(structure[0]):
+                parts += cls.get_csv_parts(sub_structure, prefix + str(i+1) + '.')
+            return parts
+
+        content_type = (structure[0] + b'/' + structure[1]).decode().lower()
+        params = cls._get_params(structure[2])
+        encoding = (structure[5] or b'7bit').decode().lower()
+        # disposition follows lines (text) or size, md5 (others)
+        disposition_index = 9 if structure[0].lower() == b'text' else 8
+        if len(structure) > disposition_index and isinstance(structure[disposition_index], tuple) \
+                and len(structure[disposition_index]) > 1:
+            params.update(cls._get_params(structure[disposition_index][1]))
+        filename = params.get('filename') or params.get('name') or ''
+        if content_type == 'text/csv' or filename.lower().endswith('.csv'):
+            parts.append((prefix.rstrip('.') or '1', encoding, params.get('charset', 'utf-8'), filename))
+        return parts
+
+
+    @staticmethod
+    def _get_params(values):
+        # IMAP parameter lists are flat tuples of names and values
+        if not values:
+            return {}
+        return {values[i].decode().lower(): values[i+1].decode(errors='replace')
+                for i in range(0, len(values) - 1, 2)}
+
+
+    def decode_message(self, raw):
+        """Get text, CsvDecoder and filename of all attachments of a message."""
+        msg = email.message_from_bytes(raw)
         # some more integrity checks
         if not msg.is_multipart() or msg['subject'] != self.config['EMAIL']['subject']:
             logging.getLogger().error("invalid message detected")
-            return
+            return []
         logging.getLogger().info("processing email message from " + msg.get("Date"))
 
-        # decode message body
-        msg_body_qp = msg.get_payload(0).as_string()
-        msg_body_qp_bytes = bytes(msg_body_qp, 'UTF-8')
-        msg_body_bytes = quopri.decodestring(msg_body_qp_bytes)
-        msg_body = msg_body_bytes.decode('UTF-8')
-
-        # extract attachments
-        self.__process_attachments(msg)
-
-
-    def __process_attachments(self, msg):
-        mail_parts = msg.get_payload()
-        # remove message body, which is first part
-        mail_parts[0:1] = []
-        # loop through attachments
-        for attachment in mail_parts:
-            csv = attachment.get_payload()
-            # dump file
-            with open(attachment.get_filename(), "w") as text_file:
+        attachments = []
+        # skip message body, which is first part
+        for attachment in msg.get_payload()[1:]:
+            # decode transfer encoding in memory
+            payload = attachment.get_payload(decode=True) or b''
+            csv = self.decode_text(payload, attachment.get_content_charset() or 'utf-8')
+            decoder = None
+            if self._decoderobservers:
+                decoder = CsvDecoder(self.config)
+                decoder.decode(csv)
+            attachments.append((csv, decoder, attachment.get_filename()))
+        return attachments
+
+
+    def __notify(self, csv, decoder, filename):
+        # archive file
+        if self.archive_dir and filename:
+            with open(os.path.join(self.archive_dir, os.path.basename(filename)), "w") as text_file:
                 text_file.write(csv)
 
-            # notify listener on new data
-            for observer in self._csvobservers:
-                observer(csv)
+        # notify listener on new data
+        for observer in self._csvobservers:
+            observer(csv)
+        for observer in self._decoderobservers:
+            observer(decoder)
@@ -7,86 +7,109 @@ import os
 import logging
 import datetime
 import traceback
-import configparser
-import paho.mqtt.client as mqtt
+import asyncio
+import signal
+import threading
 
 # self-defined modules
 from blindctrl.shared.stdscript import StandardScript
 from blindctrl.zamg.mailparser import MailParser
 from blindctrl.zamg.csvdecoder import CsvDecoder
-from blindctrl.shared.opcclient import OpcClient
-from blindctrl.shared.httpclient import HttpClient
+from blindctrl.shared.clients import get_opc_client, get_async_opc_client
+from blindctrl.shared.statestore import create_state_store
+from blindctrl.shared.history import create_history
+from blindctrl.shared.deadband import create_change_filter
+from blindctrl.shared.mqttsink import get_mqtt_sink
 
 
 usage = """\
 Usage: {name} [<filename>]
+       {name} idle
+       {name} --from-cache
 
 If <filename> is given, it parses the csv content and writes its data to the
 datapoint.
 If <filename> is not given, it fetches email from the configured email server and
 downloads and processes all data files.
+In idle mode it holds an IMAP IDLE session and processes new data files as
+soon as the server announces them.
+All modes write temperature and sun interpolated to the current minute.
+With --from-cache they are taken from the forecast cached by the last mail
+processing, without IMAP access.
 """
 
 
 class Zamg(StandardScript):
-    def __init__(self):
+    def __init__(self, config=None):
         # call parent constructor
-        super().__init__()
+        super().__init__(config)
 
         # setup OPC interface
         if self.config['OPC_STORAGE']['enabled']:
-            if "type_json" in self.config['OPC_STORAGE'] and self.config['OPC_STORAGE']['type_json']:
-                self.opcclient = HttpClient(self.config['OPC_STORAGE']['url'],
-                                            self.config['OPC_STORAGE']['password'])
-            else:
-                self.opcclient = OpcClient(self.config['OPC_STORAGE']['url'],
-                                           self.config['OPC_STORAGE']['password'])
+            self.opcclient = get_opc_client(self.config)
+            self.async_opcclient = get_async_opc_client(self.config)
+
+        # setup data file storage
+        if self.config['FILE_STORAGE']['enabled']:
+            self.state_store = create_state_store(self.config)
+
+        # setup change detection of outputs
+        self.change_filter = create_change_filter(self.config, 'zamg')
+
+        # setup history
+        self.history = create_history(self.config)
 
         # setup mqtt connection
         if self.config['MQTT_STORAGE']['enabled']:
-            self.mqtt = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
-            # quick and dirty: we assume to be connected before we finished email parsing...
-            #self.mqtt.on_connect = self._on_mqtt_connect
-            if 'user' in self.config['MQTT_STORAGE']:
-                self.mqtt.username_pw_set(self.config['MQTT_STORAGE']['user'],
-                                          self.config['MQTT_STORAGE']['password'])
-            self.mqtt.connect(self.config['MQTT_STORAGE']['host'],
-                              self.config['MQTT_STORAGE']['port'])
-            self.mqtt.loop_start()
+            self.mqtt = get_mqtt_sink(self.config)
+
+        # setup forecast cache
+        self.forecast_cache = None
+        if self.config.get('FORECAST_CACHE') and self.config['FORECAST_CACHE']['enabled']:
+            self.forecast_cache = self.config['FORECAST_CACHE']['filename']
 
         # setup data members
         self.data = None
+        # latest decoded forecast, cached once per batch of mails
+        self.decoder = None
 
     def process_csv(self, csv):
-        try:
-            decoder = CsvDecoder(self.config)
-            decoder.decode(csv)
+        decoder = CsvDecoder(self.config)
+        decoder.decode(csv)
+        self.process_decoder(decoder)
+        self.save_cache()
 
+    def process_decoder(self, decoder):
+        try:
             # process data
-            self.sun_today = 0
-            entry_found = False
-
-            # loop through data
-            for row in decoder.data:
-                # is this timestamp fitting?
-                timediff = (row['date']-datetime.datetime.utcnow()).total_seconds()
-                # is data not older than 0.5 hours?
-                if timediff >= 0:
-                    # sum minutes of remaining sun for today
-                    if row['date'].date() == datetime.datetime.utcnow().date():
-                        self.sun_today += row['sun']
-
-                    # is this the most recent timestamp?
-                    if not entry_found:
-                        # store this data row as our best guess
-                        self.data = row
-                        entry_found = True
+            now = datetime.datetime.utcnow()
+            # sum minutes of remaining sun for today
+            self.sun_today = decoder.get_sun_today(now)
+            # the forecast at the current minute, same as for --from-cache
+            row = decoder.get_forecast(now)
+            if row is not None:
+                self.data = row
+            # decoders are notified in order of arrival, the last one wins
+            self.decoder = decoder
 
         except Exception as e:
             logging.getLogger().error(traceback.format_exc())
             raise
 
-    def set_opc(self, temperature, sun):
+    def save_cache(self):
+        """keep the full series of the latest forecast for --from-cache"""
+        if self.forecast_cache is None or self.decoder is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.forecast_cache)), exist_ok=True)
+            self.decoder.save(self.forecast_cache)
+        except Exception:
+            # the current data is still valid, just not cached
+            logging.getLogger().error(traceback.format_exc())
+        self.decoder = None
+
+    def get_opc_items(self, temperature, sun):
+        """Get keys, tags, values and types of the changed OPC items."""
         # setup values
         opc_tags = []
         types = []
@@ -106,29 +129,61 @@ class Zamg(StandardScript):
             types.append('float')
             values.append(sun)
 
+        # skip unchanged values
+        return self.change_filter.select_changed('opc:', opc_tags, values, types)
+
+    def set_opc(self, temperature, sun):
+        keys, opc_tags, values, types = self.get_opc_items(temperature, sun)
+
         # write data to OPC
         if len(opc_tags):
             self.opcclient.write(opc_tags, types, values)
+            self.change_filter.commit(keys, values)
 
-    def set_file(self, temperature, sun):
-        config = configparser.ConfigParser()
-        # read existing file data
-        if os.path.isfile(self.config['FILE_STORAGE']['filename']):
-            config.read(self.config['FILE_STORAGE']['filename'])
+    async def set_opc_async(self, temperature, sun):
+        keys, opc_tags, values, types = self.get_opc_items(temperature, sun)
+        if len(opc_tags):
+            values_ok = await self.async_opcclient.write(opc_tags, types, values)
+            # only record accepted values, the others are retried next time
+            self.change_filter.commit([key for key, ok in zip(keys, values_ok) if ok],
+                                      [value for value, ok in zip(values, values_ok) if ok])
 
-        config[self.scriptname] = {}
-        config[self.scriptname]['Temperature'] = str(temperature)
-        config[self.scriptname]['SunPower'] = str(sun)
-        with open(self.config['FILE_STORAGE']['filename'], 'w') as configfile:
-            config.write(configfile)
+    def get_file_values(self, temperature, sun):
+        return {
+            'Temperature': str(temperature),
+            'SunPower': str(sun),
+        }
+
+    def set_file(self, temperature, sun):
+        values = self.get_file_values(temperature, sun)
+        keys = ['file:zamg/' + name for name in values]
+        # save data file, if anything changed or it got lost, e.g. in /tmp on reboot
+        if self.change_filter.any_changed(keys, values.values()) or \
+                not self.state_store.read_section('zamg'):
+            self.state_store.write_section('zamg', values)
+            self.change_filter.commit(keys, list(values.values()))
+
+    async def set_file_async(self, temperature, sun):
+        values = self.get_file_values(temperature, sun)
+        keys = ['file:zamg/' + name for name in values]
+        loop = asyncio.get_running_loop()
+        if self.change_filter.any_changed(keys, values.values()) or \
+                not await loop.run_in_executor(None, self.state_store.read_section, 'zamg'):
+            await loop.run_in_executor(None, self.state_store.write_section, 'zamg', values)
+            self.change_filter.commit(keys, list(values.values()))
 
     def set_mqtt(self, temperature, sun, sun_today):
-        # publish values to MQTT broker
-        path = self.config['MQTT_STORAGE']['prefix']+"zamg"
-        self.mqtt.publish(path+"/temperature", temperature, retain=True)
-        self.mqtt.publish(path+"/sun", sun, retain=True)
-        self.mqtt.publish(path+"/sun_today", sun_today)
-        self.mqtt.publish(path+"/last_update", str(datetime.datetime.now()), retain=True)
+        # publish changed values to MQTT broker
+        # retain flags are configured per topic in MQTT_STORAGE
+        keys, topics, values = self.change_filter.select_changed(
+            'mqtt:' + self.mqtt.prefix, ["zamg/temperature", "zamg/sun", "zamg/sun_today"],
+            [temperature, sun, sun_today])
+        for topic, value in zip(topics, values):
+            self.mqtt.publish(topic, value)
+        if len(topics):
+            self.mqtt.publish("zamg/last_update", str(datetime.datetime.now()))
+            if self.mqtt.flush():
+                self.change_filter.commit(keys, values)
 
     def process_mail(self):
         # check for entered configuration
@@ -140,13 +195,46 @@ class Zamg(StandardScript):
         try:
             # setup mail parser
             mailparser = MailParser(self.config)
-            mailparser.add_csvobserver(self.process_csv)
+            mailparser.add_decoderobserver(self.process_decoder)
             # start retrieval
             mailparser.parse()
+            self.save_cache()
 
         except Exception as e:
             logging.getLogger().error(traceback.format_exc())
 
+    def process_cache(self):
+        """take temperature and sun of the cached forecast at the current minute"""
+        if self.forecast_cache is None:
+            raise Exception("No forecast cache configured in FORECAST_CACHE")
+        now = datetime.datetime.utcnow()
+        decoder = CsvDecoder(self.config)
+        try:
+            decoder.load(self.forecast_cache)
+        except FileNotFoundError:
+            logging.getLogger().error("Forecast cache {} not found".format(self.forecast_cache))
+            return
+        self.data = decoder.get_forecast(now)
+        if self.data is None:
+            logging.getLogger().error("Forecast cache does not cover current time")
+            return
+        self.sun_today = decoder.get_sun_today(now)
+
+    def watch_mail(self):
+        """process new mail on arrival, until SIGINT or SIGTERM"""
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+        signal.signal(signal.SIGINT, lambda *args: stopped.set())
+
+        logging.getLogger().info("Watching mail server " + self.config['EMAIL']['servername'])
+        mailparser = MailParser(self.config)
+        mailparser.add_decoderobserver(self.process_decoder)
+
+        def on_data():
+            self.save_cache()
+            self.process_data()
+        mailparser.watch(on_data, stopped.is_set)
+
     def process_data(self):
         # if retrieval succeeded we have valid data now
         if self.data:
@@ -160,32 +248,71 @@ class Zamg(StandardScript):
                 self.set_file(self.data['temperature'], self.data['sun']/60)
             if self.config['MQTT_STORAGE']['enabled']:
                 self.set_mqtt(self.data['temperature'], self.data['sun']/60, self.sun_today)
+            if self.history is not None:
+                self.history.append('zamg', ['temperature', 'sun', 'sun_today'],
+                                    [self.data['temperature'], self.data['sun']/60, self.sun_today])
 
+    async def process_data_async(self):
+        """process_data as coroutine, writing to all sinks in parallel"""
+        if self.data:
+            temperature = self.data['temperature']
+            sun = self.data['sun']/60
+            logging.getLogger().info("Set temperature: {}, sun: {:2f}".format(temperature, sun))
 
-def main():
-    """main entry point"""
-    # init functionality
-    zamg = Zamg()
-    # fetch csv files from email server
-    zamg.process_mail()
-    zamg.process_data()
+            loop = asyncio.get_running_loop()
+            sinks = []
+            if self.config['OPC_STORAGE']['enabled']:
+                sinks.append(self.set_opc_async(temperature, sun))
+            if self.config['FILE_STORAGE']['enabled']:
+                sinks.append(self.set_file_async(temperature, sun))
+            if self.history is not None:
+                sinks.append(loop.run_in_executor(
+                    None, self.history.append, 'zamg', ['temperature', 'sun', 'sun_today'],
+                    [temperature, sun, self.sun_today]))
+            if self.config['MQTT_STORAGE']['enabled']:
+                sinks.append(loop.run_in_executor(None, self.set_mqtt, temperature, sun, self.sun_today))
+            await asyncio.gather(*sinks)
 
 
-if __name__ == "__main__":
-    if len(sys.argv) == 1:
-        # main entry point
-        main()
+def main(argv=None):
+    """main entry point, also of the installed zamg script"""
+    if argv is None:
+        argv = sys.argv[1:]
 
-    elif len(sys.argv) == 2:
+    if len(argv) == 0:
+        # init functionality
+        zamg = Zamg()
+        # fetch csv files from email server
+        zamg.process_mail()
+        zamg.process_data()
+
+    elif argv == ['--from-cache']:
+        # init functionality
+        zamg = Zamg()
+        # interpolate cached forecast
+        zamg.process_cache()
+        zamg.process_data()
+
+    elif argv == ['idle']:
+        # init functionality
+        zamg = Zamg()
+        # process mail on arrival
+        zamg.watch_mail()
+
+    elif len(argv) == 1:
         # init functionality
         zamg = Zamg()
         # parse file given on command line
-        logging.getLogger().info("Importing file " + sys.argv[1])
-        if os.path.isfile(sys.argv[1]):
-            zamg.process_csv(open(sys.argv[1], 'rb').read().decode())
+        logging.getLogger().info("Importing file " + argv[0])
+        if os.path.isfile(argv[0]):
+            zamg.process_csv(open(argv[0], 'rb').read().decode())
             zamg.process_data()
         else:
             logging.getLogger().error("Import file not found.")
 
     else:
         print(usage.format(name="zamg"))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ import pkg_resources
 # needed packages
 REQUIRES = [
     'ephem',
+    'numpy',
     'RPi.GPIO >= 0.6',
     'imapclient',
     'paho-mqtt >= 2',
@@ -36,6 +37,11 @@ def run_setup(args):
                 'zamg=blindctrl.zamg.zamg:main',
                 'astrotime=blindctrl.sunpower.astrotime:main',
                 'remotectrl=blindctrl.remote.remotectrl:main',
+                'ctrlwatch=blindctrl.remote.ctrlwatch:main',
+                'mqttctrl=blindctrl.remote.mqttctrl:main',
+                'blindsched=blindctrl.service.scheduler:main',
+                'blindctrld=blindctrl.service.blindctrld:main',
+                'blindpipe=blindctrl.service.pipeline:main',
             ],
         },
     )